@@ -0,0 +1,196 @@
+import sys
+import json
+import math
+import time
+import argparse
+import numpy as np
+from main import GraphicsEngine
+from scene import FLOOR_SIZE
+from scene_file import SCENE_FILE
+
+# frames per camera path, the first WARMUP_FRAMES upload assets and are not measured
+BENCHMARK_FRAMES = 300
+WARMUP_FRAMES = 10
+# scene clock step, fixed so every run animates the same
+FRAME_TIME = 1 / 60
+# a case whose p50 or p95 frame time grows past this ratio of the baseline fails
+REGRESSION_THRESHOLD = 1.1
+
+
+def look_at(position, target):
+    # (yaw, pitch) of a camera at position looking at target, see Camera
+    dx, dy, dz = (t - p for p, t in zip(position, target))
+    yaw = math.degrees(math.atan2(dz, dx))
+    pitch = math.degrees(math.atan2(dy, math.hypot(dx, dz)))
+    return yaw, pitch
+
+
+def orbit(t):
+    # circle around the playground, looking at its centre
+    angle = t * 2 * math.pi
+    position = (40 * math.cos(angle), 8, 40 * math.sin(angle))
+    return position, look_at(position, (0, 0, 0))
+
+
+def flythrough(t):
+    # from the start view through the arch and across the tables
+    position = (40 - 70 * t, 5 - 3 * t, 8 * math.sin(t * 2 * math.pi))
+    return position, (180 + 20 * math.sin(t * 4 * math.pi), 10 - 15 * t)
+
+
+def ground(t):
+    # low walk between the objects, looking along the path
+    angle = t * 2 * math.pi
+    position = (12 * math.cos(angle), 1, 12 * math.sin(angle))
+    ahead = (12 * math.cos(angle + 0.3), 1, 12 * math.sin(angle + 0.3))
+    return position, look_at(position, ahead)
+
+
+# name -> path(t) for t in [0, 1] -> (position, (yaw, pitch))
+PATHS = {"orbit": orbit, "flythrough": flythrough, "ground": ground}
+
+
+def get_poses(path, frames=BENCHMARK_FRAMES):
+    # x y z yaw pitch time per frame, as read by render.py
+    poses = []
+    for frame in range(frames):
+        position, (yaw, pitch) = PATHS[path](frame / frames)
+        poses.append((*position, yaw, pitch, frame * FRAME_TIME))
+    return poses
+
+
+def get_percentiles(times):
+    times = np.array(times) * 1000
+    return {
+        "mean": float(times.mean()),
+        "p50": float(np.percentile(times, 50)),
+        "p95": float(np.percentile(times, 95)),
+        "p99": float(np.percentile(times, 99)),
+        "max": float(times.max()),
+    }
+
+
+def run_case(
+    path,
+    floor_size,
+    win_size,
+    frames=BENCHMARK_FRAMES,
+    profile=False,
+    scene=SCENE_FILE,
+):
+    start = time.perf_counter()
+    app = GraphicsEngine(
+        win_size=win_size, headless=True, floor_size=floor_size, scene=scene
+    )
+    startup = time.perf_counter() - start
+    renderer = app.scene_renderer
+    # gpu timers per pass and object category, see profiler.py
+    app.profiler.profiling = app.profiler.enabled = profile
+    frame_times, draw_calls = [], []
+    timings = {}
+    warmup = min(WARMUP_FRAMES, frames // 2)
+    for frame, (x, y, z, yaw, pitch, pose_time) in enumerate(get_poses(path, frames)):
+        app.time = pose_time
+        app.delta_time = FRAME_TIME * 1000
+        app.camera.set_pose((x, y, z), yaw, pitch)
+        start = time.perf_counter()
+        app.render()
+        # wait for the gpu, otherwise the frame only measures submission
+        app.ctx.finish()
+        frame_time = time.perf_counter() - start
+        if frame == 0:
+            first_frame = frame_time
+        if frame < warmup:
+            continue
+        frame_times.append(frame_time)
+        draw_calls.append(renderer.queue.draw_calls)
+        for stage, seconds in app.profiler.last_cpu.items():
+            timings.setdefault(stage, []).append(seconds)
+    objects = len(app.scene.objects)
+    gpu = app.profiler.get_stats()["gpu"]
+    app.destroy()
+    return {
+        "path": path,
+        "scene": scene,
+        "floor_size": floor_size,
+        "objects": objects,
+        "startup": startup,
+        "first_frame": first_frame,
+        "frame_time": get_percentiles(frame_times),
+        "draw_calls": float(np.mean(draw_calls)),
+        "stages": {stage: get_percentiles(times) for stage, times in timings.items()},
+        "gpu": gpu,
+    }
+
+
+def compare(results, baseline):
+    # regressed cases as strings, cases missing from the baseline are skipped
+    cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        base = cases.get(case["name"])
+        if base is None:
+            continue
+        for stat in ("p50", "p95"):
+            ratio = case["frame_time"][stat] / base["frame_time"][stat]
+            case.setdefault("baseline_ratio", {})[stat] = ratio
+            if ratio > REGRESSION_THRESHOLD:
+                regressions.append(f"{case['name']} {stat} {ratio:.2f}x")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scripted camera benchmark")
+    parser.add_argument("--paths", nargs="+", default=list(PATHS), choices=list(PATHS))
+    parser.add_argument("--floor", type=int, nargs="+", default=[FLOOR_SIZE])
+    parser.add_argument("--scene", default=SCENE_FILE, help="scene .json or .npz")
+    parser.add_argument("--frames", type=int, default=BENCHMARK_FRAMES)
+    parser.add_argument("--size", type=int, nargs=2, default=(1600, 900))
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="earlier output to compare against")
+    parser.add_argument(
+        "--profile", action="store_true", help="also time passes on the gpu"
+    )
+    args = parser.parse_args()
+
+    results = {
+        "size": args.size,
+        "frames": args.frames,
+        "scene": args.scene,
+        "cases": [],
+    }
+    for floor_size in args.floor:
+        for path in args.paths:
+            case = run_case(
+                path,
+                floor_size,
+                tuple(args.size),
+                args.frames,
+                args.profile,
+                args.scene,
+            )
+            case["name"] = f"{path}/floor{floor_size}"
+            results["cases"].append(case)
+            frame_time = case["frame_time"]
+            print(
+                f"{case['name']}: {case['objects']} objects, "
+                f"startup {case['startup']:.2f} s, "
+                f"mean {frame_time['mean']:.1f} p50 {frame_time['p50']:.1f} "
+                f"p95 {frame_time['p95']:.1f} p99 {frame_time['p99']:.1f} ms, "
+                f"{case['draw_calls']:.0f} draws"
+            )
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file))
+        results["regressions"] = regressions
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    for regression in regressions:
+        print("regression:", regression)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
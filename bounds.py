@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def get_matrix(m_model):
+    # glm matrices are column major, so this is the transpose of m_model
+    return np.frombuffer(m_model.to_bytes(), dtype="f4").reshape(4, 4)
+
+
+def get_matrices(m_models):
+    data = b"".join(m_model.to_bytes() for m_model in m_models)
+    return np.frombuffer(data, dtype="f4").reshape(-1, 4, 4)
+
+
+class Bounds:
+    def __init__(self, positions):
+        positions = np.asarray(positions, dtype="f4")
+        # axis aligned box
+        self.min = positions.min(axis=0)
+        self.max = positions.max(axis=0)
+        # bounding sphere around the box center
+        self.center = (self.min + self.max) * 0.5
+        self.radius = float(np.linalg.norm(positions - self.center, axis=1).max())
+
+    def transform(self, matrices):
+        # world bounds for a stack of (transposed) model matrices, see get_matrices
+        rot_scale = matrices[:, :3, :3]
+        translation = matrices[:, 3, :3]
+        # sphere, scaled by the largest axis scale
+        centers = self.center @ rot_scale + translation
+        scales = np.linalg.norm(rot_scale, axis=2).max(axis=1)
+        radii = self.radius * scales
+        # box, around the same center with absolute rotated extents
+        extents = ((self.max - self.min) * 0.5) @ np.abs(rot_scale)
+        return centers, radii, centers - extents, centers + extents
+
+
+def test_rows(frustum, world_bounds, rows, group_visible=None, index=None):
+    # frustum test of world_bounds, or of world_bounds[index], entries whose
+    # transform store row is in a group outside the frustum are rejected untested
+    if index is not None:
+        world_bounds = [array[index] for array in world_bounds]
+        rows = rows[index]
+    if group_visible is None:
+        return frustum.test(*world_bounds)
+    visible = group_visible[rows]
+    test = np.flatnonzero(visible)
+    visible[test] = frustum.test(*[array[test] for array in world_bounds])
+    return visible
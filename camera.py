@@ -1,5 +1,6 @@
 import glm
 import pygame as pg
+from shader_program import CAMERA_BINDING
 
 FOV = 50  # deg
 NEAR = 0.1
@@ -13,6 +14,9 @@ class Camera:
         self.app = app
         self.aspect_ratio = app.WIN_SIZE[0] / app.WIN_SIZE[1]
         self.position = glm.vec3(position)
+        # position after the last two simulation steps, rendered in between
+        self.previous_position = glm.vec3(position)
+        self.next_position = glm.vec3(position)
         self.up = glm.vec3(0, 1, 0)
         self.right = glm.vec3(1, 0, 0)
         self.forward = glm.vec3(0, 0, -1)
@@ -22,6 +26,10 @@ class Camera:
         self.m_view = self.get_view_matrix()
         # projection matrix
         self.m_proj = self.get_projection_matrix()
+        # uniform block (std140)
+        self.ubo = app.ctx.buffer(reserve=144)
+        self.ubo.bind_to_uniform_block(CAMERA_BINDING)
+        self.write_ubo()
 
     def rotate(self):
         rel_x, rel_y = pg.mouse.get_rel()
@@ -40,30 +48,62 @@ class Camera:
         self.right = glm.normalize(glm.cross(self.forward, glm.vec3(0, 1, 0)))
         self.up = glm.normalize(glm.cross(self.right, self.forward))
 
-    def update(self):
+    def step(self):
+        # one fixed simulation step, see GraphicsEngine.run
+        self.previous_position = glm.vec3(self.next_position)
         self.move()
+
+    def update(self, alpha=1.0):
+        # once per rendered frame, alpha is how far the frame is into the next step
         self.rotate()
         self.update_camera_vectors()
+        self.position = glm.mix(self.previous_position, self.next_position, alpha)
+        self.m_view = self.get_view_matrix()
+        self.write_ubo()
+
+    def set_pose(self, position, yaw, pitch):
+        # scripted camera, e.g. poses read by render.py
+        self.position = glm.vec3(position)
+        self.previous_position = glm.vec3(position)
+        self.next_position = glm.vec3(position)
+        self.yaw = yaw
+        self.pitch = max(-89, min(89, pitch))
+        self.update_camera_vectors()
         self.m_view = self.get_view_matrix()
+        self.write_ubo()
+
+    def write_ubo(self):
+        self.ubo.write(
+            b"".join(
+                [
+                    self.m_proj.to_bytes(),
+                    self.m_view.to_bytes(),
+                    glm.vec4(self.position, 0).to_bytes(),
+                ]
+            )
+        )
 
     def move(self):
         velocity = SPEED * self.app.delta_time
         keys = pg.key.get_pressed()
         if keys[pg.K_w]:
-            self.position += self.forward * velocity
+            self.next_position += self.forward * velocity
         if keys[pg.K_s]:
-            self.position -= self.forward * velocity
+            self.next_position -= self.forward * velocity
         if keys[pg.K_a]:
-            self.position -= self.right * velocity
+            self.next_position -= self.right * velocity
         if keys[pg.K_d]:
-            self.position += self.right * velocity
+            self.next_position += self.right * velocity
         if keys[pg.K_q]:
-            self.position += self.up * velocity
+            self.next_position += self.up * velocity
         if keys[pg.K_e]:
-            self.position -= self.up * velocity
+            self.next_position -= self.up * velocity
 
     def get_view_matrix(self):
         return glm.lookAt(self.position, self.position + self.forward, self.up)
 
     def get_projection_matrix(self):
         return glm.perspective(glm.radians(FOV), self.aspect_ratio, NEAR, FAR)
+
+    def destroy(self):
+        self.ubo.release()
@@ -0,0 +1,269 @@
+import numpy as np
+from bounds import get_matrix, test_rows
+from camera import FAR
+from instancing import InstanceGroup
+from lod import select_lods
+from static_batch import StaticBatch
+
+# items that cull themselves, everything else is tested as a single model
+SELF_CULLING = (InstanceGroup, StaticBatch)
+# how far a caster's shadow is assumed to reach along the light ray
+SHADOW_DISTANCE = FAR
+
+
+class Frustum:
+    def __init__(self, m_proj_view):
+        # planes (a, b, c, d) from the rows of the clip matrix, normals point inwards
+        m = get_matrix(m_proj_view).T
+        planes = np.array(
+            [
+                m[3] + m[0],  # left
+                m[3] - m[0],  # right
+                m[3] + m[1],  # bottom
+                m[3] - m[1],  # top
+                m[3] + m[2],  # near
+                m[3] - m[2],  # far
+            ]
+        )
+        self.planes = planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+    def get_distances(self, points):
+        return points @ self.planes[:, :3].T + self.planes[:, 3]
+
+    def test_spheres(self, centers, radii):
+        return np.all(self.get_distances(centers) > -radii[:, None], axis=1)
+
+    def test_swept_spheres(self, centers, radii, directions, length):
+        # a sphere moved along a direction is outside a plane only if both ends are
+        start = self.get_distances(centers)
+        end = self.get_distances(centers + directions * length)
+        return np.all(np.maximum(start, end) > -radii[:, None], axis=1)
+
+    def test_boxes(self, mins, maxs):
+        # test the box corner furthest along each plane normal
+        normals = self.planes[:, :3]
+        corners = np.where(normals > 0, maxs[:, None, :], mins[:, None, :])
+        distances = np.einsum("npk,pk->np", corners, normals) + self.planes[:, 3]
+        return np.all(distances >= 0, axis=1)
+
+    def test(self, centers, radii, mins, maxs):
+        # cheap sphere test first, boxes only for the spheres that pass
+        mask = self.test_spheres(centers, radii)
+        index = np.flatnonzero(mask)
+        mask[index] = self.test_boxes(mins[index], maxs[index])
+        return mask
+
+
+class CasterFrustum:
+    def __init__(self, light_frustum, frustum, light_direction):
+        self.light_frustum = light_frustum
+        self.frustum = frustum
+        # orthographic shadows, every caster is extruded the same way
+        direction = np.array(light_direction, dtype="f4")
+        self.direction = direction / np.linalg.norm(direction)
+
+    def test(self, centers, radii, mins, maxs):
+        # casters inside the light frustum ...
+        mask = self.light_frustum.test(centers, radii, mins, maxs)
+        index = np.flatnonzero(mask)
+        # ... whose shadow can land inside the camera frustum
+        mask[index] = self.frustum.test_swept_spheres(
+            centers[index], radii[index], self.direction, SHADOW_DISTANCE
+        )
+        return mask
+
+
+class Culler:
+    def __init__(self, app):
+        self.app = app
+        self.camera = app.camera
+        self.light = app.light
+        self.models = []
+        self.index = {}
+        self.bounds = None
+        # transform store row of each model
+        self.rows = None
+        self.dynamic = []
+        # models whose mesh has more than one lod
+        self.lod_models = []
+        self.lod_counts = None
+        # scene graph groups holding objects, a box around everything below
+        # each, see Scene.add_group, and the nearest group of each store row
+        self.groups = []
+        self.group_meshes = []
+        self.group_rows = []
+        self.group_bounds = None
+        self.dynamic_groups = []
+        self.row_groups = None
+
+    def build(self, items):
+        self.models = []
+        world = []
+        for item in items:
+            if isinstance(item, SELF_CULLING):
+                item.build_bounds()
+            else:
+                self.models.append(item)
+                world.append(self.get_world_bounds(item))
+        self.index = {id(obj): i for i, obj in enumerate(self.models)}
+        self.dynamic = [i for i, obj in enumerate(self.models) if obj.dynamic]
+        self.lod_models = [i for i, obj in enumerate(self.models) if len(obj.lods) > 1]
+        self.lod_counts = np.array([len(self.models[i].lods) for i in self.lod_models])
+        self.bounds = [np.concatenate(arrays) for arrays in zip(*world)]
+        self.rows = np.array([obj.index for obj in self.models], dtype="i8")
+        self.build_groups(self.app.scene.groups, self.app.scene.objects)
+
+    def build_groups(self, groups, objects):
+        transforms = self.app.transforms
+        rows = {obj.index: obj for obj in objects}
+        self.groups, self.group_meshes, self.dynamic_groups = [], [], []
+        self.group_rows = []
+        for group in groups:
+            # objects below the group, by mesh so their boxes transform in bulk
+            meshes = {}
+            dynamic = False
+            for row in group.get_descendants():
+                obj = rows.get(row)
+                if obj is not None:
+                    meshes.setdefault(id(obj.bounds), (obj.bounds, []))[1].append(row)
+                    dynamic |= obj.dynamic
+            if not meshes:
+                continue
+            if dynamic:
+                self.dynamic_groups.append(len(self.groups))
+            self.groups.append(group)
+            self.group_meshes.append(list(meshes.values()))
+            self.group_rows.append(
+                np.concatenate([rows for _, rows in meshes.values()])
+            )
+        count = len(self.groups)
+        self.group_bounds = [
+            np.zeros((count, 3), dtype="f4"),
+            np.zeros(count, dtype="f4"),
+            np.zeros((count, 3), dtype="f4"),
+            np.zeros((count, 3), dtype="f4"),
+        ]
+        for i in range(count):
+            self.update_group(i)
+        # shallow groups first so the nearest group of a row is written last
+        self.row_groups = np.full(transforms.count, -1, dtype="i8")
+        depths = [transforms.depths[group.index] for group in self.groups]
+        for i in np.argsort(depths, kind="stable"):
+            self.row_groups[self.groups[i].get_descendants()] = i
+
+    def update_group(self, i):
+        mins, maxs = [], []
+        for bounds, rows in self.group_meshes[i]:
+            matrices = self.app.transforms.get_matrices(rows)
+            _, _, box_min, box_max = bounds.transform(matrices)
+            mins.append(box_min.min(axis=0))
+            maxs.append(box_max.max(axis=0))
+        box_min, box_max = np.min(mins, axis=0), np.max(maxs, axis=0)
+        centers, radii, group_mins, group_maxs = self.group_bounds
+        centers[i] = (box_min + box_max) * 0.5
+        radii[i] = np.linalg.norm(box_max - centers[i])
+        group_mins[i], group_maxs[i] = box_min, box_max
+
+    def test_groups(self, frustum):
+        # per store row, False when the row's group is outside the frustum,
+        # None when there is nothing to skip
+        if frustum is None or not self.groups:
+            return None
+        visible = frustum.test(*self.group_bounds)
+        # rows outside any group index the trailing True
+        return np.append(visible, True)[self.row_groups]
+
+    @staticmethod
+    def get_world_bounds(obj):
+        return obj.bounds.transform(obj.m_model[None])
+
+    def get_frustum(self):
+        return Frustum(self.camera.m_proj * self.camera.m_view)
+
+    def get_light_frustum(self, cascade=0):
+        m_proj_light = self.light.m_proj_light[cascade]
+        return Frustum(m_proj_light * self.light.m_view_light)
+
+    def get_caster_frustum(self, frustum, cascade=0):
+        light_frustum = self.get_light_frustum(cascade)
+        light_direction = self.light.direction - self.light.position
+        return CasterFrustum(light_frustum, frustum, light_direction)
+
+    def get_scene_bounds(self, items):
+        mins, maxs = [], []
+        for item in items:
+            if isinstance(item, SELF_CULLING):
+                mins.append(item.world_bounds[2].min(axis=0))
+                maxs.append(item.world_bounds[3].max(axis=0))
+        if self.models:
+            mins.append(self.bounds[2].min(axis=0))
+            maxs.append(self.bounds[3].max(axis=0))
+        return np.min(mins, axis=0), np.max(maxs, axis=0)
+
+    def update(self):
+        # refresh moving objects, static bounds are kept from build
+        for i in self.dynamic:
+            world = self.get_world_bounds(self.models[i])
+            for array, value in zip(self.bounds, world):
+                array[i] = value[0]
+        for i in self.dynamic_groups:
+            self.update_group(i)
+
+    def move(self, moved):
+        # bounds of static models and groups holding a moved row,
+        # moved is a mask over store rows
+        for i in np.flatnonzero(moved[self.rows]).tolist():
+            world = self.get_world_bounds(self.models[i])
+            for array, value in zip(self.bounds, world):
+                array[i] = value[0]
+        for i, rows in enumerate(self.group_rows):
+            if moved[rows].any():
+                self.update_group(i)
+
+    def update_lods(self, items):
+        # lods from the camera for both passes, returns True if a static item switched
+        position = np.array(self.camera.position)
+        changed = False
+        for item in items:
+            if isinstance(item, InstanceGroup) and item.update_lods(position):
+                changed |= not item.dynamic
+        if not self.lod_models:
+            return changed
+        index = self.lod_models
+        lods = select_lods(
+            self.bounds[0][index], self.bounds[1][index], position, self.lod_counts
+        )
+        for i, lod in zip(index, lods.tolist()):
+            obj = self.models[i]
+            if obj.lod != lod:
+                obj.lod = lod
+                changed |= not obj.dynamic
+        return changed
+
+    def test_models(self, items, frustum, group_visible):
+        models = [item for item in items if not isinstance(item, SELF_CULLING)]
+        if frustum is None or not models:
+            return models, [True] * len(models)
+        index = None
+        if len(models) != len(self.models):
+            index = [self.index[id(obj)] for obj in models]
+        visible = test_rows(frustum, self.bounds, self.rows, group_visible, index)
+        return models, visible.tolist()
+
+    def cull(self, items, frustum):
+        # frustum None marks everything visible,
+        # groups are tested first and only objects in visible groups after
+        group_visible = self.test_groups(frustum)
+        for item in items:
+            if isinstance(item, SELF_CULLING):
+                item.cull(frustum, group_visible)
+        for obj, visible in zip(*self.test_models(items, frustum, group_visible)):
+            obj.visible = visible
+
+    def cull_shadow(self, items, frustum):
+        group_visible = self.test_groups(frustum)
+        for item in items:
+            if isinstance(item, SELF_CULLING):
+                item.cull_shadow(frustum, group_visible)
+        for obj, visible in zip(*self.test_models(items, frustum, group_visible)):
+            obj.shadow_visible = visible
@@ -0,0 +1,240 @@
+import numpy as np
+from bounds import test_rows
+from lod import select_lods
+from model import ExtendedBaseModel
+from texture import TEXTURE_ARRAYS
+
+# smallest number of objects sharing a mesh and texture worth an instanced draw
+MIN_INSTANCES = 2
+
+
+class InstanceGroup:
+    def __init__(self, app, vao_name, tex_id, objects):
+        self.app = app
+        self.ctx = app.ctx
+        self.vao_name = vao_name
+        self.tex_id = tex_id
+        self.objects = objects
+        self.dynamic = any(obj.dynamic for obj in objects)
+        self.bounds = objects[0].bounds
+        # per-instance transform rows, model matrices, texture array layers and lods
+        self.transforms = app.transforms
+        self.indices = np.array([obj.index for obj in objects])
+        self.matrices = self.transforms.get_matrices(self.indices)
+        self.layers = None
+        if TEXTURE_ARRAYS:
+            self.layers = np.array([obj.layer for obj in objects], dtype="f4")
+        vao = app.mesh.vao
+        vbo = vao.vbo.vbos[vao_name]
+        # the instanced vaos below are built on this vbo, keep it resident
+        self.vbo = vbo
+        app.mesh.residency.pin(vbo)
+        self.lods = vbo.lods
+        self.instance_lods = np.zeros(len(objects), dtype="i8")
+        # culled instances of each lod, per pass
+        everything = np.ones(len(objects), dtype=bool)
+        self.instance_buffers = [
+            self.ctx.buffer(self.get_instances(everything), dynamic=True)
+            for _ in self.lods
+        ]
+        self.shadow_buffers = [
+            self.ctx.buffer(self.matrices, dynamic=True) for _ in self.lods
+        ]
+        self.counts = [len(objects)] + [0] * (len(self.lods) - 1)
+        self.shadow_counts = list(self.counts)
+        self.visible = True
+        self.shadow_visible = True
+        # world bounds and visibility of each instance, per pass
+        self.world_bounds = None
+        self.mask = None
+        self.shadow_mask = None
+        # vaos, one per lod instance buffer
+        self.program = vao.program.programs["default_instanced"]
+        self.shadow_program = vao.program.programs["shadow_map_instanced"]
+        self.vaos = [
+            vao.get_instanced_vao(
+                program=self.program,
+                vbo=vbo,
+                instance_buffer=instance_buffer,
+                layers=self.layers is not None,
+            )
+            for instance_buffer in self.instance_buffers
+        ]
+        self.shadow_vaos = [
+            vao.get_instanced_vao(
+                program=self.shadow_program, vbo=vbo, instance_buffer=instance_buffer
+            )
+            for instance_buffer in self.shadow_buffers
+        ]
+        # render state for sorting
+        self.vao = self.vaos[0]
+        self.shadow_vao = self.shadow_vaos[0]
+
+    @property
+    def texture(self):
+        return self.app.mesh.texture.textures[self.tex_id]
+
+    def get_distance(self, position):
+        # distance to the nearest instance origin
+        origins = self.matrices[:, 3, :3]
+        return float(np.linalg.norm(origins - np.array(position), axis=1).min())
+
+    def sort_instances(self, position):
+        # front to back, so the depth test rejects hidden fragments early
+        origins = self.matrices[:, 3, :3]
+        order = np.argsort(np.linalg.norm(origins - np.array(position), axis=1))
+        self.objects = [self.objects[i] for i in order]
+        self.indices = self.indices[order]
+        self.matrices = self.matrices[order]
+        self.instance_lods = self.instance_lods[order]
+        if self.layers is not None:
+            self.layers = self.layers[order]
+        self.build_bounds()
+
+    def build_bounds(self):
+        self.world_bounds = self.bounds.transform(self.matrices)
+        # force a rewrite of the instance buffers
+        self.mask = None
+        self.shadow_mask = None
+
+    def update_lods(self, position):
+        # returns True if an instance switched lod
+        if len(self.lods) == 1:
+            return False
+        lods = select_lods(*self.world_bounds[:2], position, len(self.lods))
+        if np.array_equal(lods, self.instance_lods):
+            return False
+        self.instance_lods = lods
+        # force a rewrite of the instance buffers
+        self.mask = None
+        self.shadow_mask = None
+        return True
+
+    def get_instances(self, selected, layers=True):
+        # instance buffer rows, the shadow programs take no layer
+        matrices = self.matrices[selected]
+        if not layers or self.layers is None:
+            return matrices
+        return np.hstack([matrices.reshape(-1, 16), self.layers[selected, None]])
+
+    def write_instances(self, mask, buffers, layers=True):
+        # visible instances split by lod, returns the count per lod
+        counts = []
+        for lod, buffer in enumerate(buffers):
+            instances = self.get_instances(mask & (self.instance_lods == lod), layers)
+            if len(instances):
+                buffer.write(instances)
+            counts.append(len(instances))
+        return counts
+
+    def get_mask(self, frustum, last_mask, group_visible):
+        if frustum is None:
+            mask = np.ones(len(self.objects), dtype=bool)
+        else:
+            mask = test_rows(
+                frustum, self.world_bounds, self.indices, group_visible
+            )
+        if not self.dynamic and last_mask is not None and np.array_equal(mask, last_mask):
+            return None
+        return mask
+
+    def cull(self, frustum, group_visible=None):
+        mask = self.get_mask(frustum, self.mask, group_visible)
+        if mask is None:
+            return
+        self.mask = mask
+        self.counts = self.write_instances(mask, self.instance_buffers)
+        self.visible = any(self.counts)
+
+    def cull_shadow(self, frustum, group_visible=None):
+        mask = self.get_mask(frustum, self.shadow_mask, group_visible)
+        if mask is None:
+            return
+        self.shadow_mask = mask
+        self.shadow_counts = self.write_instances(
+            mask, self.shadow_buffers, layers=False
+        )
+        self.shadow_visible = any(self.shadow_counts)
+
+    def update(self):
+        if not self.dynamic:
+            return
+        self.matrices = self.transforms.get_matrices(self.indices)
+        self.world_bounds = self.bounds.transform(self.matrices)
+
+    def refresh(self):
+        # a static group after some of its objects moved
+        self.matrices = self.transforms.get_matrices(self.indices)
+        self.build_bounds()
+
+    def render_lods(self, vaos, counts):
+        for (first, vertices), vao, count in zip(self.lods, vaos, counts):
+            if count:
+                vao.render(vertices=vertices, first=first, instances=count)
+
+    def render_shadow(self):
+        self.render_lods(self.shadow_vaos, self.shadow_counts)
+
+    def render(self):
+        self.app.mesh.texture.use(self.texture, location=0)
+        self.app.mesh.residency.touch(self.vbo)
+        self.render_lods(self.vaos, self.counts)
+
+    def destroy(self):
+        self.app.mesh.residency.unpin(self.vbo)
+        [vao.release() for vao in self.vaos + self.shadow_vaos]
+        [buffer.release() for buffer in self.instance_buffers + self.shadow_buffers]
+
+
+class Instancer:
+    def __init__(self, app):
+        self.app = app
+        programs = app.mesh.vao.program.programs
+        self.program = programs["default_instanced"]
+        self.shadow_program = programs["shadow_map_instanced"]
+        self.groups = []
+
+    def build(self, objects):
+        # group objects by source mesh and texture, names sharing a mesh file
+        # end up in the same group, with texture arrays objects only have to
+        # share the array, moving ones are kept apart so static groups stay static,
+        # returns the objects that still have to be drawn on their own
+        self.release_groups()
+        vbos = self.app.mesh.vao.vbo.vbos
+        batches = {}
+        rest = []
+        for obj in objects:
+            if isinstance(obj, ExtendedBaseModel):
+                material = obj.texture if TEXTURE_ARRAYS else obj.tex_id
+                key = (vbos[obj.vao_name], material, obj.dynamic)
+                batches.setdefault(key, []).append(obj)
+            else:
+                rest.append(obj)
+
+        for group_objects in batches.values():
+            if len(group_objects) < MIN_INSTANCES:
+                rest += group_objects
+                continue
+            vao_name = group_objects[0].vao_name
+            tex_id = group_objects[0].tex_id
+            self.groups.append(
+                InstanceGroup(self.app, vao_name, tex_id, group_objects)
+            )
+        return rest
+
+    def update(self):
+        for group in self.groups:
+            group.update()
+
+    def move(self, moved):
+        # static groups holding a moved row, moved is a mask over store rows
+        for group in self.groups:
+            if not group.dynamic and moved[group.indices].any():
+                group.refresh()
+
+    def release_groups(self):
+        [group.destroy() for group in self.groups]
+        self.groups = []
+
+    def destroy(self):
+        self.release_groups()
@@ -1,8 +1,32 @@
 import glm
+import numpy as np
+from itertools import product
+from bounds import get_matrix
+from camera import FOV, NEAR, FAR
+from shader_program import LIGHT_BINDING
+
+# shadow map resolution per cascade, independent of the window size
+SHADOW_MAP_SIZE = 2048
+# fit the light projection to the whole "scene" or to the camera "view"
+SHADOW_FIT = "scene"
+# number of cascades (1 - 4), more than one implies the view fit
+SHADOW_CASCADES = 1
+MAX_CASCADES = 4  # see shaders/uniforms.glsl
+# blend between logarithmic (1) and uniform (0) cascade splits
+CASCADE_LAMBDA = 0.75
+
+# maps clip space to [0, 1] texture space
+M_SHADOW_BIAS = glm.mat4(
+    0.5, 0.0, 0.0, 0.0,
+    0.0, 0.5, 0.0, 0.0,
+    0.0, 0.0, 0.5, 0.0,
+    0.5, 0.5, 0.5, 1.0,
+)
 
 
 class Light:
-    def __init__(self, position=(50, 50, -10), color=(1, 1, 1)):
+    def __init__(self, app, position=(50, 50, -10), color=(1, 1, 1)):
+        self.app = app
         self.position = glm.vec3(position)
         self.color = glm.vec3(color)
         self.direction = glm.vec3(0, 0, 0)
@@ -12,6 +36,148 @@ class Light:
         self.Is = 1.0 * self.color  # specular
         # view matrix
         self.m_view_light = self.get_view_matrix()
+        # shadow map atlas, one square tile per cascade
+        self.cascades = max(1, min(SHADOW_CASCADES, MAX_CASCADES))
+        self.fit = "view" if self.cascades > 1 else SHADOW_FIT
+        self.tiles = (1, 1) if self.cascades == 1 else (2, 1 if self.cascades == 2 else 2)
+        self.shadow_size = SHADOW_MAP_SIZE
+        self.shadow_map_size = (
+            self.shadow_size * self.tiles[0],
+            self.shadow_size * self.tiles[1],
+        )
+        # a box around the origin until the scene reports its bounds
+        self.scene_bounds = (np.full(3, -50, dtype="f4"), np.full(3, 50, dtype="f4"))
+        self.splits = [FAR] * MAX_CASCADES
+        self.m_proj_light = []
+        self.fit_scene()
+        # bumped on every change, invalidates cached shadows
+        self.version = 0
+        # uniform block (std140)
+        self.ubo = app.ctx.buffer(reserve=672)
+        self.ubo.bind_to_uniform_block(LIGHT_BINDING)
+        self.write_ubo()
+
+    def set_scene_bounds(self, box_min, box_max):
+        self.scene_bounds = (box_min, box_max)
+        self.update()
+
+    def update(self):
+        # refit, and upload only if the matrices changed
+        state = (self.m_view_light, self.m_proj_light)
+        self.m_view_light = self.get_view_matrix()
+        if self.fit == "scene":
+            self.fit_scene()
+        else:
+            self.fit_cascades()
+        if state == (self.m_view_light, self.m_proj_light):
+            return
+        self.version += 1
+        self.write_ubo()
+
+    def get_viewport(self, cascade):
+        x, y = cascade % self.tiles[0], cascade // self.tiles[0]
+        size = self.shadow_size
+        return x * size, y * size, size, size
+
+    def get_tile_matrix(self, cascade):
+        # squeeze [0, 1] texture space into the cascade's atlas tile
+        x, y = cascade % self.tiles[0], cascade // self.tiles[0]
+        sx, sy = 1 / self.tiles[0], 1 / self.tiles[1]
+        m_tile = glm.translate(glm.mat4(), glm.vec3(x * sx, y * sy, 0))
+        return glm.scale(m_tile, glm.vec3(sx, sy, 1))
+
+    def to_light_space(self, points):
+        matrix = get_matrix(self.m_view_light)
+        return points @ matrix[:3, :3] + matrix[3, :3]
+
+    def get_scene_corners(self):
+        return np.array(list(product(*zip(*self.scene_bounds))), dtype="f4")
+
+    def get_ortho(self, xy_min, xy_max):
+        # depth always spans the whole scene so every caster lands in the map,
+        # the light looks down -z
+        scene = self.to_light_space(self.get_scene_corners())
+        z_min, z_max = scene[:, 2].min(), scene[:, 2].max()
+        left, bottom = map(float, xy_min[:2])
+        right, top = map(float, xy_max[:2])
+        return glm.ortho(left, right, bottom, top, -float(z_max) - 1, -float(z_min) + 1)
+
+    def get_splits(self):
+        # practical split scheme between log and uniform
+        near, far = NEAR, FAR
+        splits = []
+        for i in range(1, self.cascades + 1):
+            fraction = i / self.cascades
+            log = near * (far / near) ** fraction
+            uniform = near + (far - near) * fraction
+            splits.append(CASCADE_LAMBDA * log + (1 - CASCADE_LAMBDA) * uniform)
+        return splits + [far] * (MAX_CASCADES - self.cascades)
+
+    def get_slice_corners(self, near, far):
+        camera = self.app.camera
+        m_proj = glm.perspective(glm.radians(FOV), camera.aspect_ratio, near, far)
+        m_inv = glm.inverse(m_proj * camera.m_view)
+        corners = []
+        for x in (-1, 1):
+            for y in (-1, 1):
+                for z in (-1, 1):
+                    corner = m_inv * glm.vec4(x, y, z, 1)
+                    corners.append(glm.vec3(corner) / corner.w)
+        return np.array(corners, dtype="f4")
+
+    def fit_view(self, near, far):
+        # a sphere around the slice keeps the size stable while the camera turns,
+        # snapping to whole texels keeps the edges from shimmering
+        corners = self.to_light_space(self.get_slice_corners(near, far))
+        center = corners.mean(axis=0)
+        radius = float(np.linalg.norm(corners - center, axis=1).max())
+        texel = 2 * radius / self.shadow_size
+        center = np.floor(center / texel) * texel
+        return self.get_ortho(center - radius, center + radius)
+
+    def fit_scene(self):
+        scene = self.to_light_space(self.get_scene_corners())
+        m_proj = self.get_ortho(scene.min(axis=0), scene.max(axis=0))
+        self.splits = [FAR] * MAX_CASCADES
+        self.m_proj_light = [m_proj] * self.cascades
+
+    def fit_cascades(self):
+        self.splits = self.get_splits()
+        near = NEAR
+        self.m_proj_light = []
+        for far in self.splits[: self.cascades]:
+            self.m_proj_light.append(self.fit_view(near, far))
+            near = far
+
+    def write_ubo(self):
+        empty = glm.mat4().to_bytes()
+        pad = MAX_CASCADES - self.cascades
+        proj_view = [m_proj * self.m_view_light for m_proj in self.m_proj_light]
+        shadow = [
+            self.get_tile_matrix(i) * M_SHADOW_BIAS * m_proj_view
+            for i, m_proj_view in enumerate(proj_view)
+        ]
+        self.ubo.write(
+            b"".join(
+                [
+                    self.m_view_light.to_bytes(),
+                    *[m.to_bytes() for m in proj_view],
+                    empty * pad,
+                    *[m.to_bytes() for m in shadow],
+                    empty * pad,
+                    glm.vec4(*self.splits[:MAX_CASCADES]).to_bytes(),
+                    glm.vec4(self.position, 0).to_bytes(),
+                    glm.vec4(self.Ia, 0).to_bytes(),
+                    glm.vec4(self.Id, 0).to_bytes(),
+                    glm.vec4(self.Is, 0).to_bytes(),
+                    glm.vec2(self.shadow_map_size).to_bytes(),
+                    glm.ivec2(self.cascades, 0).to_bytes(),
+                ]
+            )
+        )
 
     def get_view_matrix(self):
-        return glm.lookAt(self.position, self.direction, glm.vec3(0, 1, 0))
\ No newline at end of file
+        return glm.lookAt(self.position, self.direction, glm.vec3(0, 1, 0))
+
+    def destroy(self):
+        self.ubo.release()
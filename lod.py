@@ -0,0 +1,20 @@
+import numpy as np
+from camera import FOV, NEAR
+
+# projected height (fraction of the screen) below which the next coarser lod is used
+LOD_SCREEN_SIZES = (0.25, 0.1, 0.04)
+
+TAN_HALF_FOV = np.tan(np.radians(FOV) * 0.5)
+
+
+def get_screen_sizes(centers, radii, position):
+    # bounding sphere diameter over the frustum height at its distance
+    distances = np.linalg.norm(centers - np.asarray(position, dtype="f4"), axis=1)
+    return radii / (np.maximum(distances, NEAR) * TAN_HALF_FOV)
+
+
+def select_lods(centers, radii, position, lod_counts):
+    # lod per bounding sphere, clamped to the lods each mesh has
+    sizes = get_screen_sizes(centers, radii, position)
+    lods = np.sum(sizes[:, None] < np.array(LOD_SCREEN_SIZES), axis=1)
+    return np.minimum(lods, np.asarray(lod_counts) - 1)
@@ -1,78 +1,161 @@
 import pygame as pg
 import moderngl as mgl
 import sys
+from time import perf_counter
 from model import *
 from camera import Camera
 from light import Light
 from mesh import Mesh
-from scene import Scene
+from scene import Scene, FLOOR_SIZE
+from scene_file import SCENE_FILE
 from scene_renderer import SceneRenderer
+from profiler import Profiler
+from transforms import TransformStore
+
+# standalone context backend without a window, None for the platform default
+HEADLESS_BACKEND = "egl"
+# simulation step in seconds, camera movement and animation advance in these
+TIME_STEP = 1 / 120
+# longest frame the simulation catches up on, longer stalls are dropped
+MAX_FRAME_TIME = 0.25
+# frames per second to render at, 0 for uncapped or "vsync"
+FRAME_RATE = 60
 
 
 class GraphicsEngine:
-    def __init__(self, win_size=(1600, 900)):
+    def __init__(
+        self,
+        win_size=(1600, 900),
+        headless=False,
+        floor_size=FLOOR_SIZE,
+        frame_rate=FRAME_RATE,
+        scene=SCENE_FILE,
+    ):
         # init pygame modules
         pg.init()
         # window size
         self.WIN_SIZE = win_size
-        # set opengl attr
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, 3)
-        pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, 3)
-        pg.display.gl_set_attribute(
-            pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE
-        )
-        # create opengl contextw
-        pg.display.set_mode(self.WIN_SIZE, flags=pg.OPENGL | pg.DOUBLEBUF)
-        # mouse settings
-        pg.event.set_grab(True)
-        pg.mouse.set_visible(False)
-        # detect and use existing opengl context
-        self.ctx = mgl.create_context()
+        self.headless = headless
+        self.frame_rate = frame_rate
+        if headless:
+            # no window, render into an offscreen framebuffer, see render.py
+            settings = {"backend": HEADLESS_BACKEND} if HEADLESS_BACKEND else {}
+            self.ctx = mgl.create_standalone_context(require=330, **settings)
+            self.fbo = self.ctx.simple_framebuffer(self.WIN_SIZE)
+        else:
+            self.create_window()
+            # detect and use existing opengl context
+            self.ctx = mgl.create_context()
+            self.fbo = self.ctx.screen
         # self.ctx.front_face = 'cw'
+        # cpu scopes and gpu timers, see profiler.py
+        self.profiler = Profiler(self)
         self.ctx.enable(flags=mgl.DEPTH_TEST | mgl.CULL_FACE)
         # create an object to help track time
         self.clock = pg.time.Clock()
+        # simulation time after the last step, and the time rendered,
+        # which lies between the last two steps
+        self.step_time = 0
         self.time = 0
-        self.delta_time = 0
+        # milliseconds a step moves things by
+        self.delta_time = TIME_STEP * 1000
         # light
-        self.light = Light()
+        self.light = Light(self)
         # camera
         self.camera = Camera(self)
+        # positions, rotations, scales and model matrices of every object
+        self.transforms = TransformStore()
         # mesh
         self.mesh = Mesh(self)
         # scene
-        self.scene = Scene(self)
+        # scene file, .json or compiled .npz, see scene_file.py
+        self.scene = Scene(self, floor_size=floor_size, path=scene)
         # renderer
         self.scene_renderer = SceneRenderer(self)
 
+    def create_window(self):
+        # set opengl attr
+        pg.display.gl_set_attribute(pg.GL_CONTEXT_MAJOR_VERSION, 3)
+        pg.display.gl_set_attribute(pg.GL_CONTEXT_MINOR_VERSION, 3)
+        pg.display.gl_set_attribute(
+            pg.GL_CONTEXT_PROFILE_MASK, pg.GL_CONTEXT_PROFILE_CORE
+        )
+        # create opengl contextw
+        vsync = int(self.frame_rate == "vsync")
+        pg.display.set_mode(
+            self.WIN_SIZE, flags=pg.OPENGL | pg.DOUBLEBUF, vsync=vsync
+        )
+        # mouse settings
+        pg.event.set_grab(True)
+        pg.mouse.set_visible(False)
+
+    def destroy(self):
+        self.mesh.destroy()
+        self.scene_renderer.destroy()
+        self.profiler.destroy()
+        self.camera.destroy()
+        self.light.destroy()
+        if self.headless:
+            self.fbo.release()
+            self.ctx.release()
+
     def check_events(self):
         for event in pg.event.get():
             if event.type == pg.QUIT or (
                 event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE
             ):
-                self.mesh.destroy()
-                self.scene_renderer.destroy()
+                self.destroy()
                 pg.quit()
                 sys.exit()
+            if event.type == pg.KEYDOWN and event.key == pg.K_F3:
+                self.profiler.toggle_overlay()
 
     def render(self):
-        # clear framebuffer
-        self.ctx.clear(color=(0.08, 0.16, 0.18))
-        # render scene
-        self.scene_renderer.render()
+        with self.profiler.cpu("render"):
+            # clear framebuffer
+            self.fbo.use()
+            self.ctx.clear(color=(0.08, 0.16, 0.18))
+            # render scene
+            self.scene_renderer.render()
+            # profiler overlay, F3
+            self.profiler.render()
+        self.profiler.end_frame()
         # swap buffers
-        pg.display.flip()
+        if not self.headless:
+            pg.display.flip()
+
+    def step(self):
+        self.step_time += TIME_STEP
+        self.camera.step()
 
-    def get_time(self):
-        self.time = pg.time.get_ticks() * 0.001
+    def limit_frame_rate(self):
+        # vsync waits in the buffer swap instead
+        if self.frame_rate and self.frame_rate != "vsync":
+            self.clock.tick(self.frame_rate)
+        else:
+            self.clock.tick()
 
     def run(self):
+        # fixed simulation steps, frames render as fast as frame_rate allows
+        # and interpolate between the last two steps
+        accumulator = 0.0
+        last = perf_counter()
         while True:
-            self.get_time()
-            self.check_events()
-            self.camera.update()
+            now = perf_counter()
+            accumulator += min(now - last, MAX_FRAME_TIME)
+            last = now
+            with self.profiler.cpu("events"):
+                self.check_events()
+            with self.profiler.cpu("simulation"):
+                while accumulator >= TIME_STEP:
+                    self.step()
+                    accumulator -= TIME_STEP
+            alpha = accumulator / TIME_STEP
+            self.time = self.step_time + (alpha - 1) * TIME_STEP
+            with self.profiler.cpu("camera"):
+                self.camera.update(alpha)
             self.render()
-            self.delta_time = self.clock.tick(60)
+            self.limit_frame_rate()
 
 
 if __name__ == "__main__":
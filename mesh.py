@@ -1,12 +1,15 @@
 from vao import VAO
 from texture import Texture
+from residency import Residency
 
 
 class Mesh:
     def __init__(self, app):
         self.app = app
-        self.vao = VAO(app.ctx)
-        self.texture = Texture(app)
+        # gpu memory budget shared by textures and mesh buffers
+        self.residency = Residency()
+        self.vao = VAO(app.ctx, self.residency)
+        self.texture = Texture(app, self.residency)
 
     def destroy(self):
         self.vao.destroy()
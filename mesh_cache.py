@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pywavefront
+from mesh_processing import optimize_mesh, build_lods, merge_lods
+
+# welded interleaved vertices, their index buffer and lod ranges,
+# as .npy files per source mesh
+CACHE_DIR = "cache/meshes"
+CACHE_VERSION = 3
+STRIDE = 8  # 2f 3f 3f
+
+
+def get_file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_cache_paths(path):
+    name = hashlib.sha1(os.path.normpath(path).encode()).hexdigest()[:16]
+    base = os.path.join(CACHE_DIR, name)
+    return base + ".npy", base + ".idx.npy", base + ".lod.npy", base + ".json"
+
+
+def load_obj(path):
+    # Load .obj without .mtl
+    objs = pywavefront.Wavefront(
+        path,
+        cache=True,
+        parse=True,
+        collect_faces=True,  # Ensure face data is collected
+        create_materials=True,  # Automatically create default materials
+    )
+
+    # Extract geometry data from the first material
+    obj = list(objs.materials.values())[0]
+    vertex_data = obj.vertices  # Access vertex data
+    vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
+    return vertex_data
+
+
+def is_valid(meta, path, stat, version=CACHE_VERSION):
+    if not meta or meta.get("version") != version:
+        return False
+    if meta["size"] != stat.st_size:
+        return False
+    if meta["mtime"] == stat.st_mtime_ns:
+        return True
+    # touched but maybe not changed, fall back to the content hash
+    return meta["hash"] == get_file_hash(path)
+
+
+def load_mesh(path):
+    # (texcoord, normal, position) vertices, indices and lod index ranges for
+    # an .obj file, memory mapped from the cache and rebuilt whenever the source changes
+    data_path, index_path, lod_path, meta_path = get_cache_paths(path)
+    stat = os.stat(path)
+    meta = None
+    if all(map(os.path.exists, (meta_path, data_path, index_path, lod_path))):
+        with open(meta_path) as file:
+            meta = json.load(file)
+
+    if not is_valid(meta, path, stat):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        vertex_data, index_data = optimize_mesh(load_obj(path), STRIDE)
+        vertex_data, index_data, lods = merge_lods(build_lods(vertex_data, index_data))
+        np.save(data_path, vertex_data)
+        np.save(index_path, index_data)
+        np.save(lod_path, lods)
+        meta = {"version": CACHE_VERSION, "source": path, "size": stat.st_size}
+        meta["hash"] = get_file_hash(path)
+    # remember the current mtime so the next start skips hashing
+    if meta.get("mtime") != stat.st_mtime_ns:
+        meta["mtime"] = stat.st_mtime_ns
+        with open(meta_path, "w") as file:
+            json.dump(meta, file)
+
+    vertex_data = np.load(data_path, mmap_mode="r")
+    index_data = np.load(index_path, mmap_mode="r")
+    return vertex_data, index_data, np.load(lod_path)
@@ -0,0 +1,230 @@
+import numpy as np
+
+# post-transform vertex cache size assumed by the triangle reordering
+VERTEX_CACHE_SIZE = 16
+# clustering grid (cells along the longest side) of each lod after the first
+LOD_GRIDS = (48, 24, 12)
+# only meshes with at least this many triangles get lods
+LOD_MIN_TRIANGLES = 4096
+# a lod is dropped unless it has at most this fraction of the previous one's triangles
+LOD_MAX_RATIO = 0.6
+# uv cells per unit, keeps texture seams apart when clustering
+LOD_UV_CELLS = 4
+
+
+def weld(vertex_data, stride):
+    # merge bit-identical vertices, returns (vertices, indices)
+    vertex_data = np.ascontiguousarray(vertex_data, dtype="f4").reshape(-1, stride)
+    vertices, indices = np.unique(vertex_data, axis=0, return_inverse=True)
+    return vertices, indices.reshape(-1).astype("u4")
+
+
+def get_adjacency(triangles, vertex_count):
+    # triangles using each vertex, as a flat list plus offsets
+    corners = triangles.reshape(-1)
+    order = np.argsort(corners, kind="stable")
+    counts = np.bincount(corners, minlength=vertex_count)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return (order // 3).tolist(), offsets.tolist(), counts.tolist()
+
+
+def tipsify(indices, vertex_count, cache_size=VERTEX_CACHE_SIZE):
+    # triangle order for a fifo vertex cache
+    # (Sander, Nehab, Barczak: "Fast Triangle Reordering for Vertex Locality
+    # and Reduced Overdraw", 2007)
+    triangles = np.asarray(indices).reshape(-1, 3)
+    adjacent, offsets, live = get_adjacency(triangles, vertex_count)
+    corners = triangles.tolist()
+    timestamps = [0] * vertex_count
+    emitted = [False] * len(corners)
+    dead_end = []
+    order = []
+    time = cache_size + 1
+    cursor = 0
+    fan = 0
+    while fan >= 0:
+        candidates = []
+        for triangle in adjacent[offsets[fan] : offsets[fan + 1]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = True
+            order.append(triangle)
+            for vertex in corners[triangle]:
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - timestamps[vertex] > cache_size:
+                    timestamps[vertex] = time
+                    time += 1
+
+        # next fanning vertex: the candidate that stays in the cache longest
+        fan, best = -1, -1
+        for vertex in candidates:
+            if live[vertex] <= 0:
+                continue
+            priority = 0
+            if time - timestamps[vertex] + 2 * live[vertex] <= cache_size:
+                priority = time - timestamps[vertex]
+            if priority > best:
+                fan, best = vertex, priority
+        if fan >= 0:
+            continue
+        # dead end, backtrack to recently used vertices, then scan forward
+        while dead_end:
+            vertex = dead_end.pop()
+            if live[vertex] > 0:
+                fan = vertex
+                break
+        while fan < 0 and cursor < vertex_count:
+            if live[cursor] > 0:
+                fan = cursor
+            cursor += 1
+    return triangles[order].reshape(-1)
+
+
+def reorder_vertices(vertices, indices):
+    # vertices in first-use order, so fetches follow the index stream
+    _, first = np.unique(indices, return_index=True)
+    order = indices[np.sort(first)]
+    remap = np.empty(len(vertices), dtype="u4")
+    remap[order] = np.arange(len(order), dtype="u4")
+    return vertices[order], remap[indices]
+
+
+def get_index_dtype(vertex_count):
+    return "u2" if vertex_count <= 0xFFFF else "u4"
+
+
+def optimize_mesh(vertex_data, stride):
+    # triangle soup -> welded vertices and a cache-ordered index buffer
+    vertices, indices = weld(vertex_data, stride)
+    indices = tipsify(indices, len(vertices))
+    vertices, indices = reorder_vertices(vertices, indices)
+    return vertices, indices.astype(get_index_dtype(len(vertices)))
+
+
+def get_cluster_positions(positions, indices, cells):
+    # quadric error minimising point per cell (Lindstrom, "Out-of-Core
+    # Simplification of Large Polygonal Models", 2000)
+    count = cells.max() + 1
+    triangles = indices.reshape(-1, 3)
+    p0, p1, p2 = positions[triangles].transpose(1, 0, 2)
+    normals = np.cross(p1 - p0, p2 - p0)
+    areas = np.linalg.norm(normals, axis=1)
+    keep = areas > 0
+    normals = normals[keep] / areas[keep, None]
+    weights = areas[keep] * 0.5
+    distances = -np.einsum("ij,ij->i", normals, p0[keep])
+    quadric_a = weights[:, None, None] * normals[:, :, None] * normals[:, None, :]
+    quadric_b = (weights * distances)[:, None] * normals
+    a = np.zeros((count, 3, 3))
+    b = np.zeros((count, 3))
+    for corner in triangles[keep].T:
+        np.add.at(a, cells[corner], quadric_a)
+        np.add.at(b, cells[corner], quadric_b)
+    # pull flat and degenerate cells towards the mean of their vertices
+    vertex_counts = np.bincount(cells, minlength=count)[:, None]
+    mean = np.stack(
+        [np.bincount(cells, positions[:, k], count) for k in range(3)], axis=1
+    )
+    mean /= vertex_counts
+    trace = np.trace(a, axis1=1, axis2=2)
+    reg = (1e-3 * trace + 1e-12)[:, None]
+    a += reg[:, :, None] * np.eye(3)
+    points = np.linalg.solve(a, (reg * mean - b)[:, :, None])[:, :, 0]
+    # never leave the box of the cell's own vertices
+    box_min = np.full((count, 3), np.inf)
+    box_max = np.full((count, 3), -np.inf)
+    np.minimum.at(box_min, cells, positions)
+    np.maximum.at(box_max, cells, positions)
+    return np.clip(points, box_min, box_max)
+
+
+def simplify(vertices, indices, grid, texcoord=0, normal=2, position=5):
+    # vertex clustering on a grid, positions per cell so the result has no cracks,
+    # attributes per normal direction and uv cell so hard edges and seams stay
+    positions = vertices[:, position : position + 3].astype("f8")
+    normals = vertices[:, normal : normal + 3]
+    texcoords = vertices[:, texcoord : texcoord + 2]
+    box_min = positions.min(axis=0)
+    size = (positions.max(axis=0) - box_min).max() / grid
+    if size <= 0:
+        return vertices, indices
+    cell = np.minimum(((positions - box_min) / size).astype("i8"), grid - 1)
+    _, cells = np.unique(cell, axis=0, return_inverse=True)
+    cells = cells.reshape(-1)
+    points = get_cluster_positions(positions, indices, cells)
+
+    axis = np.argmax(np.abs(normals), axis=1)
+    side = normals[np.arange(len(normals)), axis] > 0
+    uv_cell = np.floor(texcoords * LOD_UV_CELLS).astype("i8")
+    keys = np.column_stack([cells, axis * 2 + side, uv_cell])
+    _, clusters = np.unique(keys, axis=0, return_inverse=True)
+    clusters = clusters.reshape(-1)
+    count = clusters.max() + 1
+    sums = np.stack(
+        [np.bincount(clusters, column, count) for column in vertices.T], axis=1
+    )
+    result = sums / np.bincount(clusters, minlength=count)[:, None]
+    first = np.zeros(count, dtype="i8")
+    first[clusters[::-1]] = np.arange(len(clusters))[::-1]
+    result[:, position : position + 3] = points[cells[first]]
+    lengths = np.linalg.norm(result[:, normal : normal + 3], axis=1, keepdims=True)
+    result[:, normal : normal + 3] /= np.maximum(lengths, 1e-8)
+
+    # drop triangles collapsed into a cell, then duplicates (winding kept)
+    triangles = clusters[indices.reshape(-1, 3)]
+    corner_cells = cells[first][triangles]
+    keep = (
+        (corner_cells[:, 0] != corner_cells[:, 1])
+        & (corner_cells[:, 1] != corner_cells[:, 2])
+        & (corner_cells[:, 2] != corner_cells[:, 0])
+    )
+    triangles = triangles[keep]
+    shift = np.argmin(triangles, axis=1)
+    rows = np.arange(len(triangles))[:, None]
+    triangles = triangles[rows, (shift[:, None] + np.arange(3)) % 3]
+    triangles = np.unique(triangles, axis=0)
+    # unreferenced clusters are dropped by reorder_vertices
+    return result.astype("f4"), triangles.reshape(-1).astype("u4")
+
+
+def build_lods(vertices, indices):
+    # [(vertices, indices)] from full detail down, each cache optimised
+    lods = [(vertices, indices)]
+    if len(indices) // 3 < LOD_MIN_TRIANGLES:
+        return lods
+    for grid in LOD_GRIDS:
+        lod_vertices, lod_indices = simplify(vertices, indices, grid)
+        if not len(lod_indices) or len(lod_indices) > LOD_MAX_RATIO * len(lods[-1][1]):
+            continue
+        lod_indices = tipsify(lod_indices, len(lod_vertices))
+        lods.append(reorder_vertices(lod_vertices, lod_indices))
+    return lods
+
+
+def merge_lods(lods):
+    # one vertex and index array, plus the (first, count) index range of each lod
+    vertices, indices, ranges = [], [], []
+    vertex_offset = index_offset = 0
+    for lod_vertices, lod_indices in lods:
+        vertices.append(lod_vertices)
+        indices.append(lod_indices.astype("u4") + vertex_offset)
+        ranges.append((index_offset, len(lod_indices)))
+        vertex_offset += len(lod_vertices)
+        index_offset += len(lod_indices)
+    index_data = np.concatenate(indices).astype(get_index_dtype(vertex_offset))
+    return np.concatenate(vertices), index_data, np.array(ranges, dtype="i8")
+
+
+def get_acmr(indices, cache_size=VERTEX_CACHE_SIZE):
+    # average cache miss ratio of a fifo cache, 3.0 is a triangle soup
+    cache = []
+    misses = 0
+    for vertex in np.asarray(indices).tolist():
+        if vertex not in cache:
+            misses += 1
+            cache.append(vertex)
+            if len(cache) > cache_size:
+                cache.pop(0)
+    return misses / (len(indices) // 3)
@@ -1,90 +1,131 @@
 import moderngl as mgl
 import numpy as np
 import glm
+from texture import TEXTURE_ARRAYS
+from transforms import Node
+
+
+class BaseModel(Node):
+    # scene graph node drawing a mesh, see transforms.py
+    __slots__ = (
+        "app",
+        "vao_name",
+        "tex_id",
+        "bounds",
+        "lods",
+        "program",
+        "camera",
+        "batch",
+        "visible",
+        "shadow_visible",
+        "lod",
+    )
+    # objects whose transform changes after construction
+    dynamic = False
 
-
-class BaseModel:
     def __init__(
         self, app, vao_name, tex_id, pos=(0, 0, 0), rot=(0, 0, 0), scale=(1, 1, 1)
     ):
+        super().__init__(app.transforms, pos, rot, scale)
+        vao = app.mesh.vao
+        self.setup(app, vao_name, tex_id, vao.vbo.vbos[vao_name], vao.vaos[vao_name])
+
+    def setup(self, app, vao_name, tex_id, vbo, vao):
+        # everything but the transform, cpu side only
         self.app = app
-        self.pos = pos
         self.vao_name = vao_name
-        self.rot = glm.vec3([glm.radians(a) for a in rot])
-        self.scale = scale
-        self.m_model = self.get_model_matrix()
         self.tex_id = tex_id
-        self.vao = app.mesh.vao.vaos[vao_name]
-        self.program = self.vao.program
-        self.camera = self.app.camera
+        # static batch this object was baked into
+        self.batch = None
+        # result of the last frustum tests, main and shadow pass
+        self.visible = True
+        self.shadow_visible = True
+        # level of detail picked from the projected size, see lod.py
+        self.lod = 0
+        self.bounds = vbo.bounds
+        self.lods = vbo.lods
+        self.program = vao.program
+        self.camera = app.camera
+
+    @classmethod
+    def create_many(cls, app, rows, vao_name, tex_id):
+        # models on transform store rows made in bulk, see TransformStore.add_many,
+        # without running the constructors
+        vao = app.mesh.vao
+        vbo, mesh_vao = vao.vbo.vbos[vao_name], vao.vaos[vao_name]
+        transforms = app.transforms
+        models = []
+        for row in rows.tolist():
+            obj = cls.__new__(cls)
+            obj.transforms = transforms
+            obj.index = row
+            obj.setup(app, vao_name, tex_id, vbo, mesh_vao)
+            models.append(obj)
+        return models
+
+    # gpu objects are looked up on use, they may have been evicted, see residency.py
+    @property
+    def vbo(self):
+        return self.app.mesh.vao.vbo.vbos[self.vao_name]
+
+    @property
+    def vao(self):
+        return self.app.mesh.vao.vaos[self.vao_name]
+
+    @property
+    def texture(self):
+        return self.app.mesh.texture.textures[self.tex_id]
 
     def update(self): ...
 
-    def get_model_matrix(self):
-        m_model = glm.mat4()
-        # translate
-        m_model = glm.translate(m_model, self.pos)
-        # rotate
-        m_model = glm.rotate(m_model, self.rot.z, glm.vec3(0, 0, 1))
-        m_model = glm.rotate(m_model, self.rot.y, glm.vec3(0, 1, 0))
-        m_model = glm.rotate(m_model, self.rot.x, glm.vec3(1, 0, 0))
-        # scale
-        m_model = glm.scale(m_model, self.scale)
-        return m_model
+    def get_distance(self, position):
+        return float(np.linalg.norm(self.world_position - np.array(position)))
+
+    def render_lod(self, vao):
+        self.app.mesh.residency.touch(self.vbo)
+        first, count = self.lods[self.lod]
+        vao.render(vertices=count, first=first)
 
     def render(self):
         self.update()
-        self.vao.render()
+        self.render_lod(self.vao)
 
 
 class ExtendedBaseModel(BaseModel):
-    def __init__(self, app, vao_name, tex_id, pos, rot, scale):
-        super().__init__(app, vao_name, tex_id, pos, rot, scale)
-        self.on_init()
+    # samplers and the shadow map are set up once for every model, see
+    # ShaderProgram and SceneRenderer, the rest is written right before drawing
+    __slots__ = ()
 
     def update(self):
-        self.texture.use(location=0)
-        self.program["camPos"].write(self.camera.position)
-        self.program["m_view"].write(self.camera.m_view)
+        self.app.mesh.texture.use(self.texture, location=0)
+        if TEXTURE_ARRAYS:
+            self.program["u_layer"] = self.layer
         self.program["m_model"].write(self.m_model)
 
+    @property
+    def layer(self):
+        # layer of the texture in its texture array, see TEXTURE_ARRAYS
+        return self.app.mesh.texture.get_layer(self.tex_id) if TEXTURE_ARRAYS else 0
+
+    @property
+    def shadow_vao(self):
+        return self.app.mesh.vao.vaos["shadow_" + self.vao_name]
+
+    @property
+    def shadow_program(self):
+        return self.shadow_vao.program
+
     def update_shadow(self):
         self.shadow_program["m_model"].write(self.m_model)
 
     def render_shadow(self):
         self.update_shadow()
-        self.shadow_vao.render()
-
-    def on_init(self):
-        self.program["m_view_light"].write(self.app.light.m_view_light)
-        # resolution
-        self.program["u_resolution"].write(glm.vec2(self.app.WIN_SIZE))
-        # depth texture
-        self.depth_texture = self.app.mesh.texture.textures["depth_texture"]
-        self.program["shadowMap"] = 1
-        self.depth_texture.use(location=1)
-        # shadow
-        self.shadow_vao = self.app.mesh.vao.vaos["shadow_" + self.vao_name]
-        self.shadow_program = self.shadow_vao.program
-        self.shadow_program["m_proj"].write(self.camera.m_proj)
-        self.shadow_program["m_view_light"].write(self.app.light.m_view_light)
-        self.shadow_program["m_model"].write(self.m_model)
-        # texture
-        self.texture = self.app.mesh.texture.textures[self.tex_id]
-        self.program["u_texture_0"] = 0
-        self.texture.use(location=0)
-        # mvp
-        self.program["m_proj"].write(self.camera.m_proj)
-        self.program["m_view"].write(self.camera.m_view)
-        self.program["m_model"].write(self.m_model)
-        # light
-        self.program["light.position"].write(self.app.light.position)
-        self.program["light.Ia"].write(self.app.light.Ia)
-        self.program["light.Id"].write(self.app.light.Id)
-        self.program["light.Is"].write(self.app.light.Is)
+        self.render_lod(self.shadow_vao)
 
 
 class Cube(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -98,15 +139,16 @@ class Cube(ExtendedBaseModel):
 
 
 class MovingCube(Cube):
+    __slots__ = ()
+    dynamic = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def update(self):
-        self.m_model = self.get_model_matrix()
-        super().update()
-
 
 class Cat(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -120,6 +162,8 @@ class Cat(ExtendedBaseModel):
 
 
 class Bola(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -133,6 +177,8 @@ class Bola(ExtendedBaseModel):
 
 
 class Apple(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -146,6 +192,8 @@ class Apple(ExtendedBaseModel):
 
 
 class Cone(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -159,6 +207,8 @@ class Cone(ExtendedBaseModel):
 
 
 class FenceRight(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -172,6 +222,8 @@ class FenceRight(ExtendedBaseModel):
 
 
 class FenceBack(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -185,6 +237,8 @@ class FenceBack(ExtendedBaseModel):
 
 
 class FenceFront(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -198,6 +252,8 @@ class FenceFront(ExtendedBaseModel):
 
 
 class Papan(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -211,6 +267,8 @@ class Papan(ExtendedBaseModel):
 
 
 class Table(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -224,6 +282,8 @@ class Table(ExtendedBaseModel):
 
 
 class Cylinder(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -237,6 +297,8 @@ class Cylinder(ExtendedBaseModel):
 
 
 class Darkwall(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -250,6 +312,8 @@ class Darkwall(ExtendedBaseModel):
 
 
 class Mug(ExtendedBaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -263,6 +327,8 @@ class Mug(ExtendedBaseModel):
 
 
 class SkyBox(BaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -276,19 +342,21 @@ class SkyBox(BaseModel):
         self.on_init()
 
     def update(self):
+        self.app.mesh.texture.use(self.texture, location=0)
         self.program["m_view"].write(glm.mat4(glm.mat3(self.camera.m_view)))
 
     def on_init(self):
         # texture
-        self.texture = self.app.mesh.texture.textures[self.tex_id]
         self.program["u_texture_skybox"] = 0
-        self.texture.use(location=0)
+        self.app.mesh.texture.use(self.texture, location=0)
         # mvp
         self.program["m_proj"].write(self.camera.m_proj)
         self.program["m_view"].write(glm.mat4(glm.mat3(self.camera.m_view)))
 
 
 class AdvancedSkyBox(BaseModel):
+    __slots__ = ()
+
     def __init__(
         self,
         app,
@@ -302,11 +370,11 @@ class AdvancedSkyBox(BaseModel):
         self.on_init()
 
     def update(self):
+        self.app.mesh.texture.use(self.texture, location=0)
         m_view = glm.mat4(glm.mat3(self.camera.m_view))
         self.program["m_invProjView"].write(glm.inverse(self.camera.m_proj * m_view))
 
     def on_init(self):
         # texture
-        self.texture = self.app.mesh.texture.textures[self.tex_id]
         self.program["u_texture_skybox"] = 0
-        self.texture.use(location=0)
+        self.app.mesh.texture.use(self.texture, location=0)
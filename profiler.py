@@ -0,0 +1,251 @@
+import os
+import json
+from time import perf_counter
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import pygame as pg
+import moderngl as mgl
+
+# time every pass and object category on the gpu and per draw item on the cpu,
+# the coarse cpu scopes are always timed
+PROFILING = False
+# frames the stats and the overlay average over
+PROFILE_WINDOW = 120
+# frames a gpu query stays in flight before it is read, so reading never stalls
+QUERY_LATENCY = 3
+# .csv or .jsonl file every frame's timings are appended to, None for no log
+PROFILE_LOG = None
+# frames per log file, a full log moves to <log>.1 and a new one starts,
+# so between one and two files worth of the latest frames are kept
+PROFILE_LOG_FRAMES = 10000
+# overlay refresh period in seconds, and the number of scopes it lists
+OVERLAY_INTERVAL = 0.5
+OVERLAY_LINES = 16
+# some drivers report this for the first query of a context
+INVALID_ELAPSED = 2**32 - 1
+
+NO_SCOPE = nullcontext()
+
+
+class Overlay:
+    def __init__(self, app):
+        self.app = app
+        self.ctx = app.ctx
+        self.font = pg.font.Font(None, 20)
+        # fullscreen triangle, the shader only keeps the pixels under the text
+        vao = app.mesh.vao
+        self.program = vao.program.programs["overlay"]
+        self.program["u_text"] = 3
+        self.vbo = vao.vbo.vbos["advanced_skybox"]
+        app.mesh.residency.pin(self.vbo)
+        self.vao = vao.get_vao(program=self.program, vbo=self.vbo)
+        self.texture = None
+        self.updated = None
+
+    def get_rows(self, stats):
+        # (scope, cpu ms, gpu ms) for the most expensive scopes
+        rows = [("scope", "cpu ms", "gpu ms")]
+        cpu, gpu = stats["cpu"], stats["gpu"]
+        scopes = sorted(
+            set(cpu) | set(gpu),
+            key=lambda scope: -max(cpu.get(scope, 0), gpu.get(scope, 0)),
+        )
+        for scope in scopes[:OVERLAY_LINES]:
+            times = [cpu.get(scope), gpu.get(scope)]
+            columns = (f"{t:.2f}" if t is not None else "" for t in times)
+            rows.append((scope, *columns))
+        return rows
+
+    def update(self, stats):
+        rows = self.get_rows(stats)
+        height = self.font.get_linesize()
+        # scope names left aligned, times right aligned in their columns
+        widths = [
+            max(self.font.size(cell)[0] for cell in column) + 12 for column in zip(*rows)
+        ]
+        size = (sum(widths) + 8, height * len(rows) + 8)
+        surface = pg.Surface(size, pg.SRCALPHA)
+        surface.fill((0, 0, 0, 160))
+        for i, (scope, *times) in enumerate(rows):
+            y = 4 + i * height
+            surface.blit(self.font.render(scope, True, (255, 255, 255)), (4, y))
+            right = 4 + widths[0]
+            for width, value in zip(widths[1:], times):
+                right += width
+                text = self.font.render(value, True, (255, 255, 255))
+                surface.blit(text, (right - 12 - text.get_width(), y))
+        if self.texture:
+            self.texture.release()
+        # rows top down, the shader flips them
+        self.texture = self.ctx.texture(
+            surface.get_size(), 4, pg.image.tostring(surface, "RGBA")
+        )
+
+    def render(self, stats):
+        if self.updated is None or perf_counter() - self.updated > OVERLAY_INTERVAL:
+            self.update(stats)
+            self.updated = perf_counter()
+        self.program["u_height"] = self.app.WIN_SIZE[1]
+        self.texture.use(location=3)
+        self.ctx.disable(mgl.DEPTH_TEST)
+        self.ctx.enable(mgl.BLEND)
+        self.vao.render()
+        self.ctx.disable(mgl.BLEND)
+        self.ctx.enable(mgl.DEPTH_TEST)
+        # the overlay took unit 3 behind the texture manager's back
+        self.app.mesh.texture.bound.pop(3, None)
+
+    def destroy(self):
+        self.app.mesh.residency.unpin(self.vbo)
+        self.vao.release()
+        if self.texture:
+            self.texture.release()
+
+
+class Profiler:
+    def __init__(
+        self,
+        app,
+        enabled=PROFILING,
+        log_path=PROFILE_LOG,
+        log_frames=PROFILE_LOG_FRAMES,
+    ):
+        self.app = app
+        self.ctx = app.ctx
+        # profiling asked for, and whether fine scopes are timed now
+        self.profiling = enabled
+        self.enabled = enabled
+        self.frame = 0
+        # scope -> seconds, this frame
+        self.cpu_times = {}
+        # the last finished frame's cpu times
+        self.last_cpu = {}
+        # (frame, scope, query) in flight, and queries ready for reuse
+        self.pending = deque()
+        self.queries = []
+        # {scope: seconds} of the last PROFILE_WINDOW frames
+        self.cpu_history = deque(maxlen=PROFILE_WINDOW)
+        self.gpu_history = deque(maxlen=PROFILE_WINDOW)
+        self.log = None
+        self.log_path = log_path
+        self.log_frames = log_frames
+        self.log_csv = bool(log_path) and log_path.endswith(".csv")
+        # frames written to the current log file
+        self.logged_frames = 0
+        if log_path:
+            self.open_log()
+        self.overlay = None
+
+    def open_log(self):
+        self.log = open(self.log_path, "w")
+        if self.log_csv:
+            self.log.write("frame,kind,scope,ms\n")
+        self.logged_frames = 0
+
+    def rotate_log(self):
+        self.log.close()
+        os.replace(self.log_path, self.log_path + ".1")
+        self.open_log()
+
+    @contextmanager
+    def cpu(self, scope):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.cpu_times[scope] = self.cpu_times.get(scope, 0) + elapsed
+
+    def gpu(self, scope):
+        # a time query, gpu timers cannot nest so only leaf scopes use them
+        if not self.enabled:
+            return NO_SCOPE
+        query = self.queries.pop() if self.queries else self.ctx.query(time=True)
+        self.pending.append((self.frame, scope, query))
+        return query
+
+    @contextmanager
+    def scope(self, scope):
+        with self.cpu(scope), self.gpu(scope):
+            yield
+
+    def item_scope(self, render_pass, item):
+        # per draw item category, e.g. main/InstanceGroup, only while profiling
+        if not self.enabled:
+            return NO_SCOPE
+        return self.scope(f"{render_pass}/{type(item).__name__}")
+
+    def toggle_overlay(self):
+        if self.overlay:
+            self.overlay.destroy()
+            self.overlay = None
+        else:
+            self.overlay = Overlay(self.app)
+        self.enabled = self.profiling or self.overlay is not None
+
+    def render(self):
+        if self.overlay:
+            self.overlay.render(self.get_stats())
+
+    def resolve_queries(self):
+        # read the queries old enough to be done, grouped by frame,
+        # each pass also gets the sum of its items
+        frames = {}
+        while self.pending and self.pending[0][0] <= self.frame - QUERY_LATENCY:
+            frame, scope, query = self.pending.popleft()
+            elapsed = query.elapsed
+            self.queries.append(query)
+            if elapsed == INVALID_ELAPSED:
+                continue
+            times = frames.setdefault(frame, {})
+            for name in {scope, scope.split("/")[0]}:
+                times[name] = times.get(name, 0) + elapsed * 1e-9
+        for frame, times in frames.items():
+            self.gpu_history.append(times)
+            self.write_log(frame, "gpu", times)
+
+    def write_log(self, frame, kind, times):
+        if not self.log:
+            return
+        if self.log_csv:
+            for scope, seconds in times.items():
+                self.log.write(f"{frame},{kind},{scope},{seconds * 1000:.4f}\n")
+        else:
+            ms = {scope: seconds * 1000 for scope, seconds in times.items()}
+            self.log.write(json.dumps({"frame": frame, "kind": kind, "ms": ms}) + "\n")
+
+    def end_frame(self):
+        self.resolve_queries()
+        self.last_cpu = self.cpu_times
+        self.cpu_history.append(self.cpu_times)
+        self.write_log(self.frame, "cpu", self.cpu_times)
+        self.cpu_times = {}
+        self.frame += 1
+        if self.log:
+            self.logged_frames += 1
+            if self.logged_frames >= self.log_frames:
+                self.rotate_log()
+
+    @staticmethod
+    def get_means(history):
+        # a scope missing from a frame counts as zero for it
+        totals = {}
+        for times in history:
+            for scope, seconds in times.items():
+                totals[scope] = totals.get(scope, 0) + seconds
+        return {scope: total / len(history) * 1000 for scope, total in totals.items()}
+
+    def get_stats(self):
+        # mean milliseconds per scope over the last PROFILE_WINDOW frames
+        return {
+            "frames": len(self.cpu_history),
+            "cpu": self.get_means(self.cpu_history),
+            "gpu": self.get_means(self.gpu_history),
+        }
+
+    def destroy(self):
+        if self.overlay:
+            self.overlay.destroy()
+        # queries have no release in moderngl, they go with the context
+        if self.log:
+            self.log.close()
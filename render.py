@@ -0,0 +1,77 @@
+import os
+import time
+import argparse
+import pygame as pg
+from main import GraphicsEngine
+from scene_file import SCENE_FILE
+
+# time between poses that give no time of their own, seconds
+FRAME_TIME = 1 / 60
+
+
+def load_poses(path):
+    # one pose per line: x y z yaw pitch [time], # starts a comment
+    poses = []
+    with open(path) as file:
+        for line in file:
+            values = [float(value) for value in line.split("#")[0].split()]
+            if not values:
+                continue
+            if len(values) not in (5, 6):
+                raise ValueError(f"{path}: expected x y z yaw pitch [time], got {line!r}")
+            if len(values) == 5:
+                values.append(len(poses) * FRAME_TIME)
+            poses.append(values)
+    return poses
+
+
+def save_frame(app, path):
+    # .png, or the raw rgb rows bottom up for anything else
+    data = app.fbo.read(components=3)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.endswith(".png"):
+        image = pg.image.frombuffer(data, app.WIN_SIZE, "RGB")
+        pg.image.save(pg.transform.flip(image, False, True), path)
+    else:
+        with open(path, "wb") as file:
+            file.write(data)
+
+
+def render(app, poses, output):
+    last_time = 0
+    for frame, (x, y, z, yaw, pitch, pose_time) in enumerate(poses):
+        app.time = pose_time
+        app.delta_time = (pose_time - last_time) * 1000
+        last_time = pose_time
+        app.camera.set_pose((x, y, z), yaw, pitch)
+        app.render()
+        if output:
+            save_frame(app, output.format(frame))
+    app.ctx.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="render camera poses without a window")
+    parser.add_argument("poses", help="text file, one 'x y z yaw pitch [time]' per line")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="frames/frame_{:04d}.png",
+        help="frame path pattern, .png or raw rgb, empty to only time the frames",
+    )
+    parser.add_argument("--size", type=int, nargs=2, default=(1600, 900))
+    parser.add_argument("--scene", default=SCENE_FILE, help="scene .json or .npz")
+    args = parser.parse_args()
+
+    poses = load_poses(args.poses)
+    app = GraphicsEngine(win_size=tuple(args.size), headless=True, scene=args.scene)
+    start = time.perf_counter()
+    render(app, poses, args.output)
+    elapsed = time.perf_counter() - start
+    frame_time = elapsed / max(len(poses), 1) * 1000
+    print(f"{len(poses)} frames in {elapsed:.2f} s, {frame_time:.1f} ms a frame")
+    app.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import glm
+from instancing import InstanceGroup
+
+# how far the camera may move (world units) or turn (deg) before the queue is resorted
+RESORT_DISTANCE = 2.0
+RESORT_ANGLE = 10.0
+
+
+class RenderQueue:
+    def __init__(self, app):
+        self.app = app
+        self.camera = app.camera
+        self.light = app.light
+        # draw items: models, instance groups and static batches
+        self.items = []
+        self.queue = []
+        self.shadow_queue = []
+        # camera pose at the last sort
+        self.position = None
+        self.forward = None
+        # draw calls issued this frame, both passes
+        self.draw_calls = 0
+
+    def build(self, items):
+        self.items = list(items)
+        self.sort()
+
+    @staticmethod
+    def get_state_ids(items, attr):
+        # small integer per distinct state object, in first-seen order
+        ids = {}
+        return [ids.setdefault(id(getattr(item, attr)), len(ids)) for item in items]
+
+    def sort(self):
+        items = self.items
+        position = glm.vec3(self.camera.position)
+        for item in items:
+            if isinstance(item, InstanceGroup):
+                item.sort_instances(position)
+        # main pass: program, vao, texture, then front to back
+        programs = self.get_state_ids(items, "program")
+        vaos = self.get_state_ids(items, "vao")
+        textures = self.get_state_ids(items, "texture")
+        depths = [item.get_distance(position) for item in items]
+        keys = list(zip(programs, vaos, textures, depths, range(len(items))))
+        self.queue = [items[key[-1]] for key in sorted(keys)]
+        # shadow pass: no textures, front to back from the light
+        programs = self.get_state_ids(items, "shadow_program")
+        vaos = self.get_state_ids(items, "shadow_vao")
+        depths = [item.get_distance(self.light.position) for item in items]
+        keys = list(zip(programs, vaos, depths, range(len(items))))
+        self.shadow_queue = [items[key[-1]] for key in sorted(keys)]
+        self.position = position
+        self.forward = glm.vec3(self.camera.forward)
+
+    def needs_sort(self):
+        if self.position is None:
+            return True
+        moved = glm.distance(self.position, self.camera.position)
+        cos_angle = glm.dot(self.forward, self.camera.forward)
+        return moved > RESORT_DISTANCE or cos_angle < glm.cos(
+            glm.radians(RESORT_ANGLE)
+        )
+
+    def update(self):
+        self.draw_calls = 0
+        if self.needs_sort():
+            self.sort()
+
+    @staticmethod
+    def get_draw_calls(item, counts):
+        # instance groups draw once per lod that has visible instances
+        if isinstance(item, InstanceGroup):
+            return sum(map(bool, getattr(item, counts)))
+        return 1
+
+    def render_shadow(self, dynamic=None):
+        # dynamic: None for every caster, else only the static or moving ones
+        item_scope = self.app.profiler.item_scope
+        for item in self.shadow_queue:
+            if item.shadow_visible and dynamic in (None, item.dynamic):
+                with item_scope("shadow", item):
+                    item.render_shadow()
+                self.draw_calls += self.get_draw_calls(item, "shadow_counts")
+
+    def render(self):
+        item_scope = self.app.profiler.item_scope
+        for item in self.queue:
+            if item.visible:
+                with item_scope("main", item):
+                    item.render()
+                self.draw_calls += self.get_draw_calls(item, "counts")
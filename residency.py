@@ -0,0 +1,73 @@
+# gpu memory budget for textures and meshes, in bytes
+RESIDENCY_BUDGET = 1024 * 2**20
+
+
+class Residency:
+    def __init__(self, budget=RESIDENCY_BUDGET):
+        self.budget = budget
+        self.frame = 0
+        # gpu object -> [bytes, last frame drawn, pins, release callback]
+        self.entries = {}
+        self.used = 0
+        # draws that found their asset resident, uploads, releases
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, obj, size, release):
+        # a freshly uploaded asset, release() must free it and forget every alias
+        self.entries[obj] = [size, self.frame, 0, release]
+        self.used += size
+        self.misses += 1
+
+    def remove(self, obj):
+        entry = self.entries.pop(obj, None)
+        if entry:
+            self.used -= entry[0]
+
+    def touch(self, obj):
+        entry = self.entries.get(obj)
+        if entry:
+            entry[1] = self.frame
+            self.hits += 1
+
+    def pin(self, obj):
+        # pinned assets are never evicted, e.g. meshes other buffers are built on
+        self.entries[obj][2] += 1
+
+    def unpin(self, obj):
+        entry = self.entries.get(obj)
+        if entry:
+            entry[2] -= 1
+
+    def evict(self):
+        # least recently drawn first, never what the current frame drew
+        if self.used <= self.budget:
+            return
+        candidates = [
+            (entry[1], obj)
+            for obj, entry in self.entries.items()
+            if entry[1] < self.frame and not entry[2]
+        ]
+        candidates.sort(key=lambda candidate: candidate[0])
+        for _, obj in candidates:
+            if self.used <= self.budget:
+                break
+            release = self.entries[obj][3]
+            self.remove(obj)
+            release()
+            self.evictions += 1
+
+    def end_frame(self):
+        self.evict()
+        self.frame += 1
+
+    def get_stats(self):
+        return {
+            "budget": self.budget,
+            "used": self.used,
+            "resident": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
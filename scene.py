@@ -1,87 +1,108 @@
 from model import *
+from transforms import Node
+from scene_file import (
+    SCENE_FILE,
+    load_scene,
+    get_model_class,
+    get_defaults,
+    fill_defaults,
+)
+import numpy as np
 import glm
 
+# half size of the cube floor, world units
+FLOOR_SIZE = 50
+
 
 class Scene:
-    def __init__(self, app):
+    def __init__(self, app, floor_size=FLOOR_SIZE, path=SCENE_FILE):
         self.app = app
+        self.floor_size = floor_size
+        # scene file, .json or compiled .npz
+        self.path = path
         self.objects = []
+        # scene graph nodes grouping objects, see transforms.py
+        self.groups = []
+        # bumped whenever the object set changes
+        self.version = 0
         self.load()
         # skybox
         self.skybox = AdvancedSkyBox(app)
 
-    def add_object(self, obj):
+    def add_object(self, obj, parent=None):
+        # with a parent, the object's transform is relative to it
+        if parent is not None:
+            parent.add(obj)
         self.objects.append(obj)
-
-    def load(self):
-        app = self.app
-        add = self.add_object
-
-        # floor
-        n, s = 50, 2
-        for x in range(-n, n, s):
-            for z in range(-n, n, s):
-                add(Cube(app, pos=(x, -s, z)))
-
-        # columns
-        # left column
-        for i in range(5):
-            add(Cube(app, pos=(18, i * s, 6), tex_id=2))
-
-        # right column
-        for i in range(5):
-            add(Cube(app, pos=(18, i * s, -6), tex_id=2))
-
-        # top bar
-        for i in range(-6, 5, s):
-            add(Cube(app, pos=(18, 4 * s, i), tex_id=2))
-
-        for i in range(9):
-            add(Cat(app, pos=(-21 + (i * 4.5), -1, 20)))
-        for i in range(9):
-            add(FenceRight(app, pos=(-17 + (i * 4.5), -1, -20)))
-        for i in range(9):
-            add(FenceBack(app, pos=(-21, -1, -20 + (i * 4.5))))
-        for i in range(3):
-            add(FenceFront(app, pos=(19, -1, -16 + (i * 4.5))))
-        for i in range(3):
-            add(FenceFront(app, pos=(19, -1, 11.5 + (i * 4.5))))
-        for i in range(3):
-            for j in range(3):
-                add(Apple(app, pos=(-0.7 + i, -0.85, 6.5 + j)))
-
-        add(Bola(app, pos=(-1, -1.5, -8)))
-        # add(Apple(app, pos=(0, -0.85, 7)))
-        add(Cone(app, pos=(-5, -0.3, -7)))
-        add(Papan(app, pos=(19.2, 8, 0)))
-
-        for i in range(2):
-            for j in range(3):
-                add(Table(app, pos=(5 + (j * -7), -1, 10 + (i * -19))))
-
-        add(Cylinder(app, pos=(-11, -0.3, -7)))
-        add(Darkwall(app, pos=(-7, 0.1, 12)))
-        add(Mug(app, pos=(-2, 0, 10)))
-
-        # moving cube
-        self.moving_cube_1 = MovingCube(app, pos=(19, 14, 0), scale=(2, 2, 2), tex_id=1)
-        add(self.moving_cube_1)
-
-        self.moving_cube_2 = MovingCube(
-            app, pos=(19, 5, 12), scale=(1.5, 1.5, 1.5), tex_id=1
-        )
-        add(self.moving_cube_2)
-
-        self.moving_cube_3 = MovingCube(
-            app, pos=(19, 5, -12), scale=(1.5, 1.5, 1.5), tex_id=1
+        self.version += 1
+
+    def add_many(
+        self, cls, positions, rotations=None, scales=None, tex_id=None, parent=None
+    ):
+        # one cls object per position, made in bulk, rotations in radians,
+        # anything left out, or UNSET rows, fall back to the constructor
+        # defaults of cls, see scene_file.py
+        defaults = get_defaults(cls)
+        rotations = fill_defaults(rotations, np.radians(defaults["rot"]))
+        scales = fill_defaults(scales, defaults["scale"])
+        if tex_id is None:
+            tex_id = defaults["tex_id"]
+        rows = self.app.transforms.add_many(
+            positions, rotations, scales, parent.index if parent is not None else -1
         )
-        add(self.moving_cube_3)
+        objects = cls.create_many(self.app, rows, defaults["vao_name"], tex_id)
+        self.objects.extend(objects)
+        self.version += 1
+        return objects
+
+    def add_group(self, pos=(0, 0, 0), rot=(0, 0, 0), scale=(1, 1, 1), parent=None):
+        # a node moving its children together, see SceneRenderer.move_static
+        group = Node(self.app.transforms, pos, rot, scale)
+        if parent is not None:
+            parent.add(group)
+        self.groups.append(group)
+        self.version += 1
+        return group
 
-        # self.moving_cube_2 = MovingCube(app, pos=(0, 6, -10), scale=(3, 3, 3), tex_id=1)
-        # add(self.moving_cube_2)
+    def load(self):
+        # floor, sized at runtime, then everything the scene file lists
+        n, s = self.floor_size, 2
+        x, z = np.mgrid[-n:n:s, -n:n:s].reshape(2, -1)
+        self.add_many(Cube, np.stack([x, np.full_like(x, -s), z], axis=1))
+        self.load_scene(load_scene(self.path))
+        self.moving_cubes = [
+            obj for obj in self.objects if isinstance(obj, MovingCube)
+        ]
+
+    def load_scene(self, scene):
+        # groups one by one, objects in bulk per type, material and group,
+        # see scene_file.py
+        meta = scene["meta"]
+        groups = []
+        for i in range(len(meta["groups"])):
+            parent = scene["group_parents"][i]
+            group = self.add_group(
+                pos=scene["group_positions"][i],
+                rot=np.degrees(scene["group_rotations"][i]),
+                scale=scene["group_scales"][i],
+                parent=groups[parent] if parent >= 0 else None,
+            )
+            groups.append(group)
+        keys = np.stack([scene["types"], scene["materials"], scene["groups"]], axis=1)
+        runs, inverse = np.unique(keys, axis=0, return_inverse=True)
+        order = np.argsort(inverse.reshape(-1), kind="stable")
+        starts = np.cumsum(np.bincount(inverse.reshape(-1)))[:-1]
+        for (type_code, material, group), rows in zip(runs, np.split(order, starts)):
+            self.add_many(
+                get_model_class(meta["types"][type_code]),
+                scene["positions"][rows],
+                scene["rotations"][rows],
+                scene["scales"][rows],
+                tex_id=meta["materials"][material],
+                parent=groups[group] if group >= 0 else None,
+            )
 
     def update(self):
-        self.moving_cube_1.rot.xyz = self.app.time
-        self.moving_cube_2.rot.xyz = self.app.time
-        self.moving_cube_3.rot.xyz = self.app.time
-        # self.moving_cube_2.rot.xyz = self.app.time
+        rot = (self.app.time,) * 3
+        for cube in self.moving_cubes:
+            cube.rot = rot
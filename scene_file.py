@@ -0,0 +1,173 @@
+import os
+import json
+import inspect
+import hashlib
+import argparse
+import numpy as np
+import model
+from mesh_cache import get_file_hash, is_valid
+
+# scenes are written as .json and loaded from flat arrays in an .npz,
+# compiled into the cache whenever the .json changes
+SCENE_FILE = "scenes/playground.json"
+CACHE_DIR = "cache/scenes"
+CACHE_VERSION = 2
+# rot or scale an entry leaves out, filled from the model defaults on load
+# so the compiled arrays hold only what the .json says
+UNSET = (np.nan, np.nan, np.nan)
+
+
+def get_model_class(name):
+    cls = getattr(model, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, model.BaseModel)):
+        raise ValueError(f"unknown object type {name!r}")
+    return cls
+
+
+def get_defaults(cls):
+    # vao_name, tex_id, rot and scale the constructor of cls falls back to
+    for base in cls.__mro__:
+        parameters = inspect.signature(base.__init__).parameters
+        if "vao_name" in parameters and "scale" in parameters:
+            names = ("vao_name", "tex_id", "rot", "scale")
+            return {name: parameters[name].default for name in names}
+    raise ValueError(f"{cls.__name__} has no default mesh")
+
+
+def fill_defaults(values, default):
+    # None, or the UNSET rows of values, become default
+    if values is None:
+        return np.asarray(default, dtype="f4")
+    unset = np.isnan(values).any(axis=1)
+    if not unset.any():
+        return values
+    values = np.array(values, dtype="f4")
+    values[unset] = default
+    return values
+
+
+def compile_scene(scene):
+    # json scene -> flat arrays, rotations in radians, values left out stay
+    # UNSET (a None material) and come from the model defaults on load
+    # {"groups": [{"name", "pos", "rot", "scale", "parent"}],
+    #  "objects": [{"type", "pos" or "positions", "rot", "scale", "tex_id", "group"}]}
+    groups = scene.get("groups", [])
+    group_index = {}
+    group_parents = []
+    for i, group in enumerate(groups):
+        # parents are listed before their children
+        group_parents.append(group_index[group["parent"]] if "parent" in group else -1)
+        group_index[group["name"]] = i
+
+    types, materials = [], []
+    names = ("type", "material", "group", "pos", "rot", "scale")
+    columns = {name: [] for name in names}
+    for entry in scene.get("objects", []):
+        name = entry["type"]
+        get_model_class(name)
+        tex_id = entry.get("tex_id")
+        if name not in types:
+            types.append(name)
+        if tex_id not in materials:
+            materials.append(tex_id)
+        # one entry places an object at each of its positions
+        positions = entry.get("positions", [entry.get("pos", (0, 0, 0))])
+        count = len(positions)
+        columns["type"] += [types.index(name)] * count
+        columns["material"] += [materials.index(tex_id)] * count
+        group = group_index[entry["group"]] if "group" in entry else -1
+        columns["group"] += [group] * count
+        columns["pos"] += positions
+        columns["rot"] += [entry.get("rot", UNSET)] * count
+        columns["scale"] += [entry.get("scale", UNSET)] * count
+
+    def get_vectors(values):
+        return np.array(values, dtype="f4").reshape(-1, 3)
+
+    def get_group_vectors(key, default):
+        return get_vectors([group.get(key, default) for group in groups])
+
+    return {
+        "types": np.array(columns["type"], dtype="u2"),
+        "materials": np.array(columns["material"], dtype="u2"),
+        "groups": np.array(columns["group"], dtype="i4"),
+        "positions": get_vectors(columns["pos"]),
+        "rotations": np.radians(get_vectors(columns["rot"])),
+        "scales": get_vectors(columns["scale"]),
+        "group_parents": np.array(group_parents, dtype="i4"),
+        "group_positions": get_group_vectors("pos", (0, 0, 0)),
+        "group_rotations": np.radians(get_group_vectors("rot", (0, 0, 0))),
+        "group_scales": get_group_vectors("scale", (1, 1, 1)),
+        # names behind the type and material codes, tex ids keep their json type,
+        # null for the model default
+        "meta": {
+            "types": types,
+            "materials": materials,
+            "groups": [group["name"] for group in groups],
+        },
+    }
+
+
+def save_scene(path, scene):
+    arrays = {key: value for key, value in scene.items() if key != "meta"}
+    np.savez(path, meta=np.array(json.dumps(scene["meta"])), **arrays)
+
+
+def read_scene(path):
+    with np.load(path) as file:
+        scene = {key: file[key] for key in file.files}
+    scene["meta"] = json.loads(str(scene["meta"]))
+    return scene
+
+
+def get_cache_paths(path):
+    name = hashlib.sha1(os.path.normpath(path).encode()).hexdigest()[:16]
+    base = os.path.join(CACHE_DIR, name)
+    return base + ".npz", base + ".json"
+
+
+def load_scene(path=SCENE_FILE):
+    # compiled arrays of a .json scene, recompiled whenever it changes,
+    # an .npz from compile_scene is read as is
+    if path.endswith(".npz"):
+        return read_scene(path)
+    data_path, meta_path = get_cache_paths(path)
+    stat = os.stat(path)
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(data_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+
+    if not is_valid(meta, path, stat, CACHE_VERSION):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path) as file:
+            try:
+                scene = compile_scene(json.load(file))
+            except (KeyError, ValueError) as error:
+                raise ValueError(f"{path}: {error}") from error
+        save_scene(data_path, scene)
+        meta = {"version": CACHE_VERSION, "source": path, "size": stat.st_size}
+        meta["hash"] = get_file_hash(path)
+    # remember the current mtime so the next start skips hashing
+    if meta.get("mtime") != stat.st_mtime_ns:
+        meta["mtime"] = stat.st_mtime_ns
+        with open(meta_path, "w") as file:
+            json.dump(meta, file)
+    return read_scene(data_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compile a .json scene to .npz")
+    parser.add_argument("scene", help="scene .json")
+    parser.add_argument("-o", "--output", help="defaults to the scene path as .npz")
+    args = parser.parse_args()
+
+    with open(args.scene) as file:
+        scene = compile_scene(json.load(file))
+    output = args.output or os.path.splitext(args.scene)[0] + ".npz"
+    save_scene(output, scene)
+    print(f"{len(scene['types'])} objects, {len(scene['group_parents'])} groups")
+
+
+if __name__ == "__main__":
+    main()
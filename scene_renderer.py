@@ -1,3 +1,21 @@
+import numpy as np
+from instancing import Instancer
+from static_batch import StaticBaker
+from render_queue import RenderQueue
+from culling import Culler
+from shadow_cache import ShadowCache
+
+# draw repeated objects with one instanced call per mesh and texture
+INSTANCING = True
+# merge static objects into one world space vbo per program and texture
+BAKE_STATIC = False
+# skip objects outside the camera frustum and shadow casters
+# that cannot shade anything visible
+FRUSTUM_CULLING = True
+# render static casters once and only redraw moving ones every frame
+SHADOW_CACHING = True
+# draw simplified meshes for objects that cover little of the screen
+LEVEL_OF_DETAIL = True
 
 
 class SceneRenderer:
@@ -6,29 +24,161 @@ class SceneRenderer:
         self.ctx = app.ctx
         self.mesh = app.mesh
         self.scene = app.scene
+        self.light = app.light
         # depth buffer
         self.depth_texture = self.mesh.texture.textures['depth_texture']
         self.depth_fbo = self.ctx.framebuffer(depth_attachment=self.depth_texture)
+        # shadow map unit of every mesh program, see shader_program.SAMPLERS
+        self.mesh.texture.use(self.depth_texture, location=1)
+        # batching
+        self.instancing = INSTANCING
+        self.baking = BAKE_STATIC
+        self.instancer = Instancer(app)
+        self.baker = StaticBaker(app)
+        # objects drawn one by one
+        self.objects = []
+        self.version = None
+        # state sorted draw order
+        self.queue = RenderQueue(app)
+        self.static_items = []
+        self.dynamic_items = []
+        # store rows of static objects, and a counter bumped whenever any moved
+        self.static_rows = None
+        self.static_version = 0
+        # visibility
+        self.culling = FRUSTUM_CULLING
+        self.culler = Culler(app)
+        self.frustum = None
+        # level of detail, bumped whenever a static item switches lod
+        self.level_of_detail = LEVEL_OF_DETAIL
+        self.lod_version = 0
+        # shadows
+        self.shadow_caching = SHADOW_CACHING
+        self.shadow_cache = ShadowCache(app)
+        programs = self.mesh.vao.program.programs
+        self.shadow_programs = [programs["shadow_map"], programs["shadow_map_instanced"]]
+        self.profiler = app.profiler
+
+    def get_version(self):
+        return self.scene.version, self.baking, self.instancing
+
+    def build(self):
+        objects = self.scene.objects
+        self.baker.release_batches()
+        self.instancer.release_groups()
+        if self.baking:
+            objects = self.baker.build(objects)
+        if self.instancing:
+            objects = self.instancer.build(objects)
+        self.objects = objects
+        items = self.baker.batches + self.instancer.groups + self.objects
+        self.queue.build(items)
+        self.culler.build(items)
+        self.light.set_scene_bounds(*self.culler.get_scene_bounds(items))
+        self.static_items = [item for item in items if not item.dynamic]
+        self.dynamic_items = [item for item in items if item.dynamic]
+        self.static_rows = np.zeros(self.app.transforms.count, dtype=bool)
+        static = [obj.index for obj in self.scene.objects if not obj.dynamic]
+        self.static_rows[static] = True
+        self.version = self.get_version()
+
+    def move_static(self, rows):
+        # static objects moved, e.g. with their group, so refresh every cache that
+        # holds them where they were: instances, baked batches, bounds and shadows
+        rows = rows[rows < len(self.static_rows)]
+        moved = np.zeros(len(self.static_rows), dtype=bool)
+        moved[rows] = self.static_rows[rows]
+        if not moved.any():
+            return
+        self.instancer.move(moved)
+        self.baker.move(moved)
+        self.culler.move(moved)
+        self.light.set_scene_bounds(*self.culler.get_scene_bounds(self.queue.items))
+        self.static_version += 1
+        self.queue.sort()
+
+    def update(self):
+        with self.profiler.cpu("scene"):
+            self.scene.update()
+            # every model matrix the scene changed, in one batch
+            self.app.transforms.update()
+        moved = self.app.transforms.get_moved()
+        if self.version != self.get_version():
+            self.build()
+        elif len(moved):
+            self.move_static(moved)
+        self.instancer.update()
+        self.queue.update()
+        self.culler.update()
+        if self.level_of_detail and self.culler.update_lods(self.queue.items):
+            self.lod_version += 1
+        if self.light.fit == "view":
+            self.light.update()
+        self.frustum = self.culler.get_frustum() if self.culling else None
+        self.culler.cull(self.queue.items, self.frustum)
+
+    def set_cascade(self, cascade):
+        for program in self.shadow_programs:
+            program["u_cascade"] = cascade
+        self.depth_fbo.viewport = self.light.get_viewport(cascade)
+
+    def render_cached_shadow(self):
+        # static casters, only when the light or the static set changed
+        key = (
+            self.version,
+            self.light.version,
+            self.culling,
+            self.lod_version,
+            self.static_version,
+        )
+        if not self.shadow_cache.is_valid(key):
+            frustum = self.culler.get_light_frustum() if self.culling else None
+            self.culler.cull_shadow(self.static_items, frustum)
+            self.shadow_cache.begin(key)
+            self.queue.render_shadow(dynamic=False)
+        # moving casters on top of a copy of the cached depth
+        frustum = self.frustum and self.culler.get_caster_frustum(self.frustum)
+        self.culler.cull_shadow(self.dynamic_items, frustum)
+        with self.profiler.gpu("shadow/cache copy"):
+            self.shadow_cache.copy_to(self.depth_fbo)
+        self.queue.render_shadow(dynamic=True)
 
     def render_shadow(self):
+        self.set_cascade(0)
+        # the cache needs a light projection that does not follow the camera
+        if self.shadow_caching and self.light.fit == "scene":
+            self.render_cached_shadow()
+            return
         self.depth_fbo.clear()
         self.depth_fbo.use()
-        for obj in self.scene.objects:
-            obj.render_shadow()
+        for cascade in range(self.light.cascades):
+            self.set_cascade(cascade)
+            frustum = self.frustum and self.culler.get_caster_frustum(
+                self.frustum, cascade
+            )
+            self.culler.cull_shadow(self.queue.items, frustum)
+            self.queue.render_shadow()
 
     def main_render(self):
-        self.app.ctx.screen.use()
-        for obj in self.scene.objects:
-            obj.render()
-        self.scene.skybox.render()
+        self.app.fbo.use()
+        self.queue.render()
+        with self.profiler.scope("main/skybox"):
+            self.scene.skybox.render()
 
     def render(self):
-        self.scene.update()
+        with self.profiler.cpu("update"):
+            self.update()
         # pass 1
-        self.render_shadow()
+        with self.profiler.cpu("shadow"):
+            self.render_shadow()
         # pass 2
-        self.main_render()
+        with self.profiler.cpu("main"):
+            self.main_render()
+        # evict what was not drawn if over the gpu memory budget
+        self.mesh.residency.end_frame()
 
     def destroy(self):
+        self.baker.destroy()
+        self.instancer.destroy()
+        self.shadow_cache.destroy()
         self.depth_fbo.release()
-
@@ -1,23 +1,80 @@
+import re
+from vertex_format import COMPACT_VERTICES
+from texture import TEXTURE_ARRAYS
+
+# uniform block binding points, shared by every program
+CAMERA_BINDING = 0
+LIGHT_BINDING = 1
+UNIFORM_BLOCKS = {"Camera": CAMERA_BINDING, "Light": LIGHT_BINDING}
+# texture units of the mesh samplers, fixed for every program that has them
+SAMPLERS = {"u_texture_0": 0, "shadowMap": 1}
+
+
 class ShaderProgram:
     def __init__(self, ctx):
         self.ctx = ctx
         self.programs = {}
-        self.programs["default"] = self.get_program("default")
+        # vertex layout of the mesh programs, see vertex_format.py
+        mesh = ("COMPACT_VERTICES",) if COMPACT_VERTICES else ()
+        # texture sampler of the textured programs
+        material = ("TEXTURE_ARRAY",) if TEXTURE_ARRAYS else ()
+        self.programs["default"] = self.get_program(
+            "default", defines=(*mesh, *material)
+        )
         self.programs["skybox"] = self.get_program("skybox")
         self.programs["advanced_skybox"] = self.get_program("advanced_skybox")
-        self.programs["shadow_map"] = self.get_program("shadow_map")
-        self.programs["bola"] = self.get_program("default")
+        self.programs["shadow_map"] = self.get_program("shadow_map", defines=mesh)
+        self.programs["bola"] = self.get_program(
+            "default", defines=(*mesh, *material)
+        )
+        self.programs["depth_copy"] = self.get_program("depth_copy")
+        self.programs["overlay"] = self.get_program("overlay")
+        # instanced variants
+        self.programs["default_instanced"] = self.get_program(
+            "default", defines=("INSTANCED", *mesh, *material)
+        )
+        self.programs["shadow_map_instanced"] = self.get_program(
+            "shadow_map", defines=("INSTANCED", *mesh)
+        )
 
-    def get_program(self, shader_program_name):
-        with open(f"shaders/{shader_program_name}.vert") as file:
-            vertex_shader = file.read()
+    @staticmethod
+    def add_defines(source, defines):
+        if not defines:
+            return source
+        # defines must come right after the #version directive
+        version, body = source.split("\n", 1)
+        lines = [f"#define {define}" for define in defines]
+        return "\n".join([version, *lines, body])
 
-        with open(f"shaders/{shader_program_name}.frag") as file:
-            fragment_shader = file.read()
+    @classmethod
+    def get_source(cls, path, defines=()):
+        with open(path) as file:
+            source = file.read()
+        # resolve #include "file" relative to the shaders directory
+        source = re.sub(
+            r'^#include "(.+)"$',
+            lambda match: cls.get_source(f"shaders/{match.group(1)}"),
+            source,
+            flags=re.MULTILINE,
+        )
+        return cls.add_defines(source, defines)
+
+    def get_program(self, shader_program_name, defines=()):
+        vertex_shader = self.get_source(f"shaders/{shader_program_name}.vert", defines)
+        fragment_shader = self.get_source(
+            f"shaders/{shader_program_name}.frag", defines
+        )
 
         program = self.ctx.program(
             vertex_shader=vertex_shader, fragment_shader=fragment_shader
         )
+        # per-frame camera and light state
+        for block, binding in UNIFORM_BLOCKS.items():
+            if block in program:
+                program[block].binding = binding
+        for sampler, location in SAMPLERS.items():
+            if sampler in program:
+                program[sampler] = location
         return program
 
     def destroy(self):
@@ -5,31 +5,37 @@ layout (location = 0) out vec4 fragColor;
 in vec2 uv_0;
 in vec3 normal;
 in vec3 fragPos;
-in vec4 shadowCoord;
+in float viewDepth;
 
-struct Light {
-    vec3 position;
-    vec3 Ia;
-    vec3 Id;
-    vec3 Is;
-};
+#include "uniforms.glsl"
 
-uniform Light light;
 uniform sampler2D u_texture_0;
-uniform vec3 camPos;
 uniform sampler2DShadow shadowMap;
-uniform vec2 u_resolution;
+
+vec4 shadowCoord;
+
+
+vec4 getShadowCoord() {
+    // the first cascade that reaches past this fragment
+    int cascade = 0;
+    for (int i = 0; i < light.cascade_count - 1; i++) {
+        if (viewDepth > light.cascade_splits[i]) cascade = i + 1;
+    }
+    vec4 coord = light.m_shadow[cascade] * vec4(fragPos, 1.0);
+    coord.z -= 0.0005;
+    return coord;
+}
 
 
 float lookup(float ox, float oy) {
-    vec2 pixelOffset = 1 / u_resolution;
+    vec2 pixelOffset = 1 / light.u_resolution;
     return textureProj(shadowMap, shadowCoord + vec4(ox * pixelOffset.x * shadowCoord.w,
                                                      oy * pixelOffset.y * shadowCoord.w, 0.0, 0.0));
 }
 
 
 float getSoftShadowX4() {
-    float shadow;
+    float shadow = 0.0;
     float swidth = 1.5;  // shadow spread
     vec2 offset = mod(floor(gl_FragCoord.xy), 2.0) * swidth;
     shadow += lookup(-1.5 * swidth + offset.x, 1.5 * swidth - offset.y);
@@ -42,7 +48,7 @@ float getSoftShadowX4() {
 
 
 float getSoftShadowX16() {
-    float shadow;
+    float shadow = 0.0;
     float swidth = 1.0;
     float endp = swidth * 1.5;
     for (float y = -endp; y <= endp; y += swidth) {
@@ -55,7 +61,7 @@ float getSoftShadowX16() {
 
 
 float getSoftShadowX64() {
-    float shadow;
+    float shadow = 0.0;
     float swidth = 0.6;
     float endp = swidth * 3.0 + swidth / 2.0;
     for (float y = -endp; y <= endp; y += swidth) {
@@ -103,6 +109,7 @@ void main() {
     vec3 color = texture(u_texture_0, uv_0).rgb;
     color = pow(color, vec3(gamma));
 
+    shadowCoord = getShadowCoord();
     color = getLight(color);
 
     color = pow(color, 1 / vec3(gamma));
@@ -1,34 +1,37 @@
 #version 330 core
 
 layout (location = 0) in vec2 in_texcoord_0;
+#ifdef COMPACT_VERTICES
+// unsigned normalized bytes, see vertex_format.py
+layout (location = 1) in vec4 in_normal;
+#else
 layout (location = 1) in vec3 in_normal;
+#endif
 layout (location = 2) in vec3 in_position;
 
 out vec2 uv_0;
 out vec3 normal;
 out vec3 fragPos;
-out vec4 shadowCoord;
+out float viewDepth;
 
-uniform mat4 m_proj;
-uniform mat4 m_view;
-uniform mat4 m_view_light;
+#include "uniforms.glsl"
 uniform mat4 m_model;
 
-mat4 m_shadow_bias = mat4(
-    0.5, 0.0, 0.0, 0.0,
-    0.0, 0.5, 0.0, 0.0,
-    0.0, 0.0, 0.5, 0.0,
-    0.5, 0.5, 0.5, 1.0
-);
+
+vec3 getNormal() {
+#ifdef COMPACT_VERTICES
+    return in_normal.xyz * 2.0 - 1.0;
+#else
+    return in_normal;
+#endif
+}
 
 
 void main() {
     uv_0 = in_texcoord_0;
     fragPos = vec3(m_model * vec4(in_position, 1.0));
-    normal = mat3(transpose(inverse(m_model))) * normalize(in_normal);
-    gl_Position = m_proj * m_view * m_model * vec4(in_position, 1.0);
-
-    mat4 shadowMVP = m_proj * m_view_light * m_model;
-    shadowCoord = m_shadow_bias * shadowMVP * vec4(in_position, 1.0);
-    shadowCoord.z -= 0.0005;
+    normal = mat3(transpose(inverse(m_model))) * normalize(getNormal());
+    vec4 viewPos = m_view * vec4(fragPos, 1.0);
+    viewDepth = -viewPos.z;
+    gl_Position = m_proj * viewPos;
 }
\ No newline at end of file
@@ -0,0 +1,8 @@
+#version 330 core
+
+uniform sampler2D u_depth;
+
+
+void main() {
+    gl_FragDepth = texelFetch(u_depth, ivec2(gl_FragCoord.xy), 0).r;
+}
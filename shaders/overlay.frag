@@ -0,0 +1,14 @@
+#version 330 core
+
+layout (location = 0) out vec4 fragColor;
+
+uniform sampler2D u_text;
+uniform float u_height;
+
+
+void main() {
+    // text in the top left corner, rows stored top down
+    ivec2 texel = ivec2(gl_FragCoord.x, u_height - gl_FragCoord.y);
+    if (any(greaterThanEqual(texel, textureSize(u_text, 0)))) discard;
+    fragColor = texelFetch(u_text, texel, 0);
+}
@@ -2,11 +2,19 @@
 
 layout (location = 2) in vec3 in_position;
 
-uniform mat4 m_proj;
-uniform mat4 m_view_light;
+#include "uniforms.glsl"
+
+#ifdef INSTANCED
+layout (location = 3) in mat4 in_model;
+#define m_model in_model
+#else
 uniform mat4 m_model;
+#endif
+
+// atlas tile being rendered
+uniform int u_cascade;
 
 void main() {
-    mat4 mvp = m_proj * m_view_light * m_model;
+    mat4 mvp = light.m_proj_view_light[u_cascade] * m_model;
     gl_Position = mvp * vec4(in_position, 1.0);
 }
\ No newline at end of file
@@ -0,0 +1,25 @@
+// per-frame uniform blocks shared by all programs, see ShaderProgram
+#define MAX_CASCADES 4
+
+layout (std140) uniform Camera {
+    mat4 m_proj;
+    mat4 m_view;
+    vec3 camPos;
+};
+
+layout (std140) uniform Light {
+    mat4 m_view_light;
+    // light projection * view, per cascade
+    mat4 m_proj_view_light[MAX_CASCADES];
+    // same with the bias and atlas tile applied, for sampling
+    mat4 m_shadow[MAX_CASCADES];
+    // view space far distance of each cascade
+    vec4 cascade_splits;
+    vec3 position;
+    vec3 Ia;
+    vec3 Id;
+    vec3 Is;
+    // shadow map atlas size
+    vec2 u_resolution;
+    int cascade_count;
+} light;
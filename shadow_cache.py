@@ -0,0 +1,42 @@
+import moderngl as mgl
+
+
+class ShadowCache:
+    def __init__(self, app):
+        self.app = app
+        self.ctx = app.ctx
+        self.texture = app.mesh.texture
+        # persistent depth of the static casters, sampled raw for the copy
+        self.depth_texture = self.texture.get_depth_texture()
+        self.depth_texture.compare_func = ""
+        self.depth_texture.filter = (mgl.NEAREST, mgl.NEAREST)
+        self.fbo = self.ctx.framebuffer(depth_attachment=self.depth_texture)
+        # fullscreen triangle writing the cached depth
+        vao = app.mesh.vao
+        self.program = vao.program.programs["depth_copy"]
+        self.program["u_depth"] = 2
+        self.vbo = vao.vbo.vbos["advanced_skybox"]
+        app.mesh.residency.pin(self.vbo)
+        self.vao = vao.get_vao(program=self.program, vbo=self.vbo)
+        # state the cache was rendered for
+        self.key = None
+
+    def is_valid(self, key):
+        return self.key == key
+
+    def begin(self, key):
+        self.key = key
+        self.fbo.clear()
+        self.fbo.use()
+
+    def copy_to(self, fbo):
+        fbo.clear()
+        fbo.use()
+        self.texture.use(self.depth_texture, location=2)
+        self.vao.render()
+
+    def destroy(self):
+        self.app.mesh.residency.unpin(self.vbo)
+        self.vao.release()
+        self.fbo.release()
+        self.depth_texture.release()
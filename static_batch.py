@@ -0,0 +1,188 @@
+import numpy as np
+import glm
+from model import ExtendedBaseModel
+from vbo import BakedVBO
+from mesh_processing import get_index_dtype
+from texture import TEXTURE_ARRAYS
+
+
+def transform_vertices(vertex_data, matrix):
+    # vertex layout: texcoord (2), normal (3), position (3),
+    # matrix transposed as in the transform store
+    rot_scale = matrix[:3, :3]
+    vertex_data = vertex_data.copy()
+    # positions to world space
+    vertex_data[:, 5:8] = vertex_data[:, 5:8] @ rot_scale + matrix[3, :3]
+    # normals by the inverse transpose of the model matrix
+    normals = vertex_data[:, 2:5] @ np.linalg.inv(rot_scale).T
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    vertex_data[:, 2:5] = normals / np.maximum(lengths, 1e-8)
+    return vertex_data
+
+
+class StaticBatch:
+    dynamic = False
+
+    def __init__(
+        self, app, program, shadow_program, tex_id, objects, vertex_data, index_data
+    ):
+        self.app = app
+        self.program = program
+        self.shadow_program = shadow_program
+        self.tex_id = tex_id
+        self.layer = objects[0].layer
+        self.objects = objects
+        self.set_geometry(vertex_data, index_data)
+        self.m_model = glm.mat4()
+        self.indices = np.array([obj.index for obj in objects])
+        for obj in objects:
+            obj.batch = self
+        self.visible = True
+        self.shadow_visible = True
+        self.world_bounds = None
+
+    def set_geometry(self, vertex_data, index_data):
+        # merged world space geometry
+        vao = self.app.mesh.vao
+        self.vbo = BakedVBO(self.app.ctx, vertex_data, index_data)
+        self.vao = vao.get_vao(program=self.program, vbo=self.vbo)
+        self.shadow_vao = vao.get_vao(program=self.shadow_program, vbo=self.vbo)
+        self.origins = np.array([obj.world_position for obj in self.objects])
+
+    def release_geometry(self):
+        self.vao.release()
+        self.shadow_vao.release()
+        self.vbo.destroy()
+
+    def rebake(self, vertex_data, index_data):
+        # after baked objects moved
+        self.release_geometry()
+        self.set_geometry(vertex_data, index_data)
+        self.build_bounds()
+
+    @property
+    def texture(self):
+        return self.app.mesh.texture.textures[self.tex_id]
+
+    def get_distance(self, position):
+        # distance to the nearest baked object origin
+        return float(np.linalg.norm(self.origins - np.array(position), axis=1).min())
+
+    def build_bounds(self):
+        # one box around every baked object, grouped by mesh
+        meshes = {}
+        for obj in self.objects:
+            meshes.setdefault(id(obj.bounds), (obj.bounds, []))[1].append(obj)
+        mins, maxs = [], []
+        for bounds, objects in meshes.values():
+            _, _, box_min, box_max = bounds.transform(
+                self.app.transforms.get_matrices([obj.index for obj in objects])
+            )
+            mins.append(box_min.min(axis=0))
+            maxs.append(box_max.max(axis=0))
+        box_min, box_max = np.min(mins, axis=0), np.max(maxs, axis=0)
+        center = (box_min + box_max) * 0.5
+        radius = np.linalg.norm(box_max - center)
+        self.world_bounds = (
+            center[None],
+            np.array([radius]),
+            box_min[None],
+            box_max[None],
+        )
+
+    def test(self, frustum, group_visible):
+        if frustum is None:
+            return True
+        # every baked object in a group outside the frustum
+        if group_visible is not None and not group_visible[self.indices].any():
+            return False
+        return bool(frustum.test(*self.world_bounds)[0])
+
+    def cull(self, frustum, group_visible=None):
+        self.visible = self.test(frustum, group_visible)
+
+    def cull_shadow(self, frustum, group_visible=None):
+        self.shadow_visible = self.test(frustum, group_visible)
+
+    def render_shadow(self):
+        self.shadow_program["m_model"].write(self.m_model)
+        self.shadow_vao.render()
+
+    def render(self):
+        self.app.mesh.texture.use(self.texture, location=0)
+        if TEXTURE_ARRAYS:
+            self.program["u_layer"] = self.layer
+        self.program["m_model"].write(self.m_model)
+        self.vao.render()
+
+    def destroy(self):
+        for obj in self.objects:
+            obj.batch = None
+        self.release_geometry()
+
+
+class StaticBaker:
+    def __init__(self, app):
+        self.app = app
+        self.batches = []
+
+    def get_mesh_data(self, vao_name, cache):
+        # keyed by the shared vbo, so each source mesh is read back once
+        vbo = self.app.mesh.vao.vbo.vbos[vao_name]
+        if vbo not in cache:
+            cache[vbo] = vbo.read()
+        return cache[vbo]
+
+    def build(self, objects):
+        # bake static objects into one batch per program and texture (layer),
+        # returns the objects that still have to be drawn on their own
+        self.release_batches()
+        materials = {}
+        rest = []
+        for obj in objects:
+            if isinstance(obj, ExtendedBaseModel) and not obj.dynamic:
+                key = (obj.program, obj.shadow_program, obj.texture, obj.layer)
+                materials.setdefault(key, []).append(obj)
+            else:
+                rest.append(obj)
+
+        mesh_cache = {}
+        for (program, shadow_program, *_), batch_objects in materials.items():
+            self.batches.append(
+                StaticBatch(
+                    self.app,
+                    program,
+                    shadow_program,
+                    batch_objects[0].tex_id,
+                    batch_objects,
+                    *self.get_batch_data(batch_objects, mesh_cache),
+                )
+            )
+        return rest
+
+    def get_batch_data(self, objects, mesh_cache):
+        # world space vertices of every object and their merged indices
+        vertices, indices = [], []
+        offset = 0
+        for obj in objects:
+            mesh_vertices, mesh_indices = self.get_mesh_data(obj.vao_name, mesh_cache)
+            vertices.append(transform_vertices(mesh_vertices, obj.m_model))
+            # indices shifted past the vertices of earlier objects
+            indices.append(mesh_indices.astype("u4") + offset)
+            offset += len(mesh_vertices)
+        index_data = np.concatenate(indices).astype(get_index_dtype(offset))
+        return np.concatenate(vertices), index_data
+
+    def move(self, moved):
+        # rebake the batches holding a moved row, moved is a mask over store rows
+        mesh_cache = {}
+        for batch in self.batches:
+            if moved[batch.indices].any():
+                batch.rebake(*self.get_batch_data(batch.objects, mesh_cache))
+
+    def release_batches(self):
+        [batch.destroy() for batch in self.batches]
+        self.batches = []
+
+    def destroy(self):
+        self.release_batches()
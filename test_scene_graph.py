@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pytest
+
+# headless rendering needs an egl context, see main.HEADLESS_BACKEND
+main = pytest.importorskip("main")
+# shaders, meshes and textures are found relative to the repository
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    try:
+        app = main.GraphicsEngine(win_size=(160, 90), headless=True, floor_size=4)
+    except Exception as error:
+        pytest.skip(f"no headless context: {error}")
+    yield app
+    app.destroy()
+
+
+def get_drawn_x(app, rows):
+    # x of the group's visible instances, read back from the instance buffer
+    for group in app.scene_renderer.instancer.groups:
+        if np.isin(group.indices, rows).any():
+            width = 16 if group.layers is None else 17
+            data = np.frombuffer(group.instance_buffers[0].read(), dtype="f4")
+            return data.reshape(-1, width)[: group.counts[0], 12]
+
+
+def test_moving_a_static_group_moves_its_instances(app):
+    arch = app.scene.groups[0]
+    rows = arch.get_descendants()
+    app.camera.set_pose((5, 5, 0), 0, 0)
+    app.render()
+    assert np.allclose(get_drawn_x(app, rows), 18)
+    arch.pos = (40, 0, 0)
+    app.camera.set_pose((25, 5, 0), 0, 0)
+    app.render()
+    assert np.allclose(get_drawn_x(app, rows), 40)
+    # the culler's box around the arch followed it
+    assert app.scene_renderer.culler.group_bounds[2][0][0] == pytest.approx(39)
+
+
+def test_moving_a_static_group_rebakes_its_batch(app):
+    app.scene_renderer.baking = True
+    app.render()
+    arch = app.scene.groups[0]
+    batch = next(
+        batch for batch in app.scene_renderer.baker.batches
+        if np.isin(batch.indices, arch.get_descendants()).any()
+    )
+    box_max = batch.world_bounds[3][0][0]
+    arch.pos = (40, 0, 0)
+    app.render()
+    assert batch.world_bounds[3][0][0] == pytest.approx(box_max + 22)
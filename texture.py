@@ -1,76 +1,248 @@
-import pygame as pg
+import os
+from concurrent.futures import ThreadPoolExecutor
 import moderngl as mgl
 import glm
+from vbo import Registry
+from texture_cache import load_image
+
+# threads reading image files and their cached mips, uploads stay on the main thread
+DECODE_WORKERS = os.cpu_count() or 1
+# largest side uploaded, bigger images start at a smaller cached mip, 0 keeps all
+MAX_TEXTURE_SIZE = 0
+# pack the TEXTURES into array layers so objects with different textures can
+# share a draw, the shaders pick the layer per object or instance
+TEXTURE_ARRAYS = False
+# every layer is resized to this, None only packs images of the same size
+TEXTURE_ARRAY_SIZE = (512, 512)
+
+# logical id -> image file, ids naming the same file share one texture
+TEXTURES = {
+    0: "textures/img.jpg",
+    1: "textures/img_1.jpg",
+    2: "textures/img_2.jpg",
+    "cat": "objects/cat/fence.png",
+    "bola": "objects/sphere/darkMarble.jpg",
+    "apple": "newobjects/Shading&Texture/Texture/Apple_Sphere.png",
+    "cone": "textures/cone2.png",
+    "fenceRight": "objects/cat/fence.png",
+    "fenceback": "objects/cat/fence.png",
+    "fencefront": "objects/cat/fence.png",
+    "papan": "textures/team.png",
+    "table": "textures/wood_meja2.png",
+    "cylinder": "textures/metal.jpg",
+    "darkwall": "textures/bricks.jpg",
+    "mug": "textures/img_2.jpg",
+}
+# logical id -> (directory, extension) of the six cube faces
+CUBE_TEXTURES = {"skybox": ("textures/skybox1/", "png")}
+CUBE_FACES = ["right", "left", "top", "bottom"] + ["front", "back"][::-1]
 
 
 class Texture:
-    def __init__(self, app):
+    def __init__(self, app, residency):
         self.app = app
         self.ctx = app.ctx
-        self.textures = {}
-        self.textures[0] = self.get_texture(path="textures/img.jpg")
-        self.textures[1] = self.get_texture(path="textures/img_1.jpg")
-        self.textures[2] = self.get_texture(path="textures/img_2.jpg")
-        self.textures["cat"] = self.get_texture(path="objects/cat/fence.png")
-        self.textures["skybox"] = self.get_texture_cube(
-            dir_path="textures/skybox1/", ext="png"
-        )
+        self.residency = residency
+        # logical id -> texture, uploaded on first use,
+        # ids loaded from the same file share one texture
+        self.textures = Registry(self.load)
+        # normalised path -> [texture, number of ids using it]
+        self.cache = {}
+        self.paths = {}
+        # texture arrays, normalised path -> layer size, tex_id -> layer
+        self.sizes = {}
+        self.layers = {}
+        # last texture bound to each texture unit
+        self.bound = {}
+        # background decodes, (key, flip_x, flip_y, mipmaps, size) -> future of
+        # [(size, rgb bytes)] per mip level, see texture_cache.py
+        self.decoder = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+        self.decoding = {}
+        # start every decode, textures are uploaded when a model first asks for them
+        for path in TEXTURES.values():
+            if TEXTURE_ARRAYS:
+                self.decode(path, mipmaps=False, size=TEXTURE_ARRAY_SIZE)
+            else:
+                self.decode(path)
+        for dir_path, ext in CUBE_TEXTURES.values():
+            self.decode_cube(dir_path, ext)
+        # render target, always resident
         self.textures["depth_texture"] = self.get_depth_texture()
-        self.textures["bola"] = self.get_texture(path="objects\sphere\darkMarble.jpg")
-        self.textures["apple"] = self.get_texture(
-            path="newobjects\Shading&Texture\Texture\Apple_Sphere.png"
+
+    @staticmethod
+    def get_key(path):
+        # same file, same key, whichever separators the caller used
+        return os.path.normpath(path.replace("\\", "/"))
+
+    def decode(self, path, flip_x=False, flip_y=True, mipmaps=True, size=None):
+        args = (self.get_key(path), flip_x, flip_y, mipmaps, size)
+        if args not in self.decoding:
+            self.decoding[args] = self.decoder.submit(load_image, *args)
+        return self.decoding[args]
+
+    def get_decoded(self, path, flip_x=False, flip_y=True, mipmaps=True, size=None):
+        # wait for the decode and drop it, the bytes are only needed for the upload
+        future = self.decode(path, flip_x, flip_y, mipmaps, size)
+        del self.decoding[(self.get_key(path), flip_x, flip_y, mipmaps, size)]
+        return future.result()
+
+    def get_cube_faces(self, dir_path, ext):
+        # (path, flip_x, flip_y, mipmaps) per face, the skybox samples no mips
+        faces = []
+        for face in CUBE_FACES:
+            side = face in ["right", "left", "front", "back"]
+            faces.append((dir_path + f"{face}.{ext}", side, not side, False))
+        return faces
+
+    def decode_cube(self, dir_path, ext="png"):
+        for face in self.get_cube_faces(dir_path, ext):
+            self.decode(*face)
+
+    def load(self, tex_id):
+        if tex_id in CUBE_TEXTURES:
+            return self.add_cube(tex_id, *CUBE_TEXTURES[tex_id])
+        if TEXTURE_ARRAYS and tex_id in TEXTURES:
+            return self.add_array(tex_id)
+        return self.add(tex_id, TEXTURES[tex_id])
+
+    def get_array_size(self, path):
+        # layer size of an image, images of one size share an array
+        key = self.get_key(path)
+        if key not in self.sizes:
+            levels = self.decode(key, mipmaps=False, size=TEXTURE_ARRAY_SIZE).result()
+            self.sizes[key] = levels[0][0]
+        return self.sizes[key]
+
+    def get_array_paths(self, size):
+        # the images packed into the array of this size, in layer order
+        paths = sorted({self.get_key(path) for path in TEXTURES.values()})
+        return [path for path in paths if self.get_array_size(path) == size]
+
+    def get_layer(self, tex_id):
+        if tex_id not in self.layers:
+            path = self.get_key(TEXTURES[tex_id])
+            paths = self.get_array_paths(self.get_array_size(path))
+            self.layers[tex_id] = paths.index(path)
+        return self.layers[tex_id]
+
+    @staticmethod
+    def get_size(texture):
+        # bytes on the gpu, a full mip chain adds a third
+        width, height = texture.size[:2]
+        faces = 6 if isinstance(texture, mgl.TextureCube) else 1
+        if isinstance(texture, mgl.TextureArray):
+            faces = texture.layers
+        size = width * height * texture.components * faces
+        if texture.filter[0] == mgl.LINEAR_MIPMAP_LINEAR:
+            size = size * 4 // 3
+        return size
+
+    def add(self, tex_id, path, loader=None):
+        # alias tex_id onto the texture loaded from path, loading it on first use
+        key = self.get_key(path)
+        if key not in self.cache:
+            texture = (loader or self.get_texture)(key)
+            self.cache[key] = [texture, 0]
+            self.residency.add(
+                texture, self.get_size(texture), lambda: self.evict(key)
+            )
+        if tex_id in self.paths:
+            self.remove(tex_id)
+        self.cache[key][1] += 1
+        self.paths[tex_id] = key
+        self.textures[tex_id] = self.cache[key][0]
+        return self.textures[tex_id]
+
+    def add_cube(self, tex_id, dir_path, ext="png"):
+        return self.add(
+            tex_id,
+            os.path.join(dir_path, f"*.{ext}"),
+            loader=lambda key: self.get_texture_cube(dir_path, ext),
         )
-        self.textures["cone"] = self.get_texture(path="textures/cone2.png")
-        self.textures["fenceRight"] = self.get_texture(path="objects/cat/fence.png")
-        self.textures["fenceback"] = self.get_texture(path="objects/cat/fence.png")
-        self.textures["fencefront"] = self.get_texture(path="objects/cat/fence.png")
-        self.textures["papan"] = self.get_texture(path="textures/team.png")
-        self.textures["table"] = self.get_texture(path="textures/wood_meja2.png")
-        self.textures["cylinder"] = self.get_texture(path="textures/metal.jpg")
-        self.textures["darkwall"] = self.get_texture(path="textures/bricks.jpg")
-        self.textures["mug"] = self.get_texture(path="textures/img_2.jpg")
+
+    def add_array(self, tex_id):
+        size = self.get_array_size(TEXTURES[tex_id])
+        return self.add(
+            tex_id,
+            "array {}x{}".format(*size),
+            loader=lambda key: self.get_texture_array(size),
+        )
+
+    def remove(self, tex_id):
+        # drop an alias, the texture is released with its last alias
+        key = self.paths.pop(tex_id)
+        del self.textures[tex_id]
+        entry = self.cache[key]
+        entry[1] -= 1
+        if not entry[1]:
+            self.residency.remove(entry[0])
+            entry[0].release()
+            del self.cache[key]
+            for location, texture in list(self.bound.items()):
+                if texture is entry[0]:
+                    del self.bound[location]
+
+    def evict(self, key):
+        # drop every alias of an evicted texture, the next lookup reloads it
+        for tex_id in [tex_id for tex_id, path in self.paths.items() if path == key]:
+            self.remove(tex_id)
 
     def get_depth_texture(self):
-        depth_texture = self.ctx.depth_texture(self.app.WIN_SIZE)
+        # sized by the light's shadow map settings, not the window
+        depth_texture = self.ctx.depth_texture(self.app.light.shadow_map_size)
         depth_texture.repeat_x = False
         depth_texture.repeat_y = False
         return depth_texture
 
     def get_texture_cube(self, dir_path, ext="png"):
-        faces = ["right", "left", "top", "bottom"] + ["front", "back"][::-1]
-        # textures = [pg.image.load(dir_path + f'{face}.{ext}').convert() for face in faces]
-        textures = []
-        for face in faces:
-            texture = pg.image.load(dir_path + f"{face}.{ext}").convert()
-            if face in ["right", "left", "front", "back"]:
-                texture = pg.transform.flip(texture, flip_x=True, flip_y=False)
-            else:
-                texture = pg.transform.flip(texture, flip_x=False, flip_y=True)
-            textures.append(texture)
-
-        size = textures[0].get_size()
+        faces = [self.get_decoded(*face) for face in self.get_cube_faces(dir_path, ext)]
+        size = faces[0][0][0]
         texture_cube = self.ctx.texture_cube(size=size, components=3, data=None)
 
-        for i in range(6):
-            texture_data = pg.image.tostring(textures[i], "RGB")
+        for i, [(_, texture_data)] in enumerate(faces):
             texture_cube.write(face=i, data=texture_data)
 
         return texture_cube
 
-    def get_texture(self, path):
-        texture = pg.image.load(path).convert()
-        texture = pg.transform.flip(texture, flip_x=False, flip_y=True)
-        texture = self.ctx.texture(
-            size=texture.get_size(),
-            components=3,
-            data=pg.image.tostring(texture, "RGB"),
+    def get_texture_array(self, size):
+        paths = self.get_array_paths(size)
+        texture_array = self.ctx.texture_array(
+            size=(*size, len(paths)), components=3, data=None
         )
-        # mipmaps
+        for layer, path in enumerate(paths):
+            [(_, data)] = self.get_decoded(path, mipmaps=False, size=TEXTURE_ARRAY_SIZE)
+            texture_array.write(data, viewport=(0, 0, layer, *size, 1))
+        # moderngl cannot write array mip levels, so these are built on the gpu
+        texture_array.filter = (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR)
+        texture_array.build_mipmaps()
+        texture_array.anisotropy = 32.0
+        return texture_array
+
+    def get_texture(self, path):
+        levels = self.get_decoded(path)
+        if MAX_TEXTURE_SIZE:
+            levels = [lvl for lvl in levels if max(lvl[0]) <= MAX_TEXTURE_SIZE]
+        size, data = levels[0]
+        texture = self.ctx.texture(size=size, components=3, data=data)
+        # mipmaps, moderngl only allocates the levels through build_mipmaps,
+        # the cached ones (filtered in linear light) then replace its output
         texture.filter = (mgl.LINEAR_MIPMAP_LINEAR, mgl.LINEAR)
         texture.build_mipmaps()
+        for level, (_, data) in enumerate(levels[1:], 1):
+            texture.write(data, level=level)
         # AF
         texture.anisotropy = 32.0
         return texture
 
+    def use(self, texture, location=0):
+        self.residency.touch(texture)
+        # skip the bind if the unit already holds this texture
+        if self.bound.get(location) is not texture:
+            texture.use(location=location)
+            self.bound[location] = texture
+
     def destroy(self):
-        [tex.release() for tex in self.textures.values()]
+        # every shared texture exactly once
+        [tex.release() for tex in set(self.textures.values())]
+        self.cache.clear()
+        self.decoder.shutdown(cancel_futures=True)
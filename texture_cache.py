@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pygame as pg
+from mesh_cache import get_file_hash, is_valid
+
+# flipped pixels with their whole mip chain, one .npy per image, flip and gamma
+CACHE_DIR = "cache/textures"
+CACHE_VERSION = 1
+# colour images are stored gamma encoded, see default.frag, and averaged in
+# linear light for the mips; files listed here hold data and are averaged as is
+GAMMA = 2.2
+LINEAR_TEXTURES = ()
+
+
+def decode(path, flip_x, flip_y, size=None):
+    image = pg.image.load(path)
+    if size and image.get_size() != tuple(size):
+        image = pg.transform.smoothscale(image, size)
+    image = pg.transform.flip(image, flip_x=flip_x, flip_y=flip_y)
+    width, height = image.get_size()
+    data = pg.image.tostring(image, "RGB")
+    return np.frombuffer(data, dtype="u1").reshape(height, width, 3)
+
+
+def downsample(image):
+    # 2x2 box filter, the sizes follow opengl (halved and floored, at least 1)
+    height, width = image.shape[:2]
+    if height > 1:
+        rows = height // 2 * 2
+        image = (image[0:rows:2] + image[1:rows:2]) * 0.5
+    if width > 1:
+        columns = width // 2 * 2
+        image = (image[:, 0:columns:2] + image[:, 1:columns:2]) * 0.5
+    return image
+
+
+def get_gamma(path):
+    # gamma the mips are averaged in, 1 for data textures
+    linear = os.path.normpath(path) in map(os.path.normpath, LINEAR_TEXTURES)
+    return 1.0 if linear else GAMMA
+
+
+def get_mip_chain(pixels, gamma):
+    levels = [pixels]
+    image = (pixels / 255) ** gamma
+    while max(image.shape[:2]) > 1:
+        image = downsample(image)
+        level = np.round(image ** (1 / gamma) * 255)
+        levels.append(level.astype("u1"))
+    return levels
+
+
+def get_cache_paths(path, flip_x, flip_y, mipmaps, size=None, gamma=GAMMA):
+    # the mips depend on the filtering gamma, so a new GAMMA or
+    # LINEAR_TEXTURES entry gets its own cache file
+    key = f"{os.path.normpath(path)}|{flip_x}|{flip_y}|{mipmaps}"
+    if mipmaps:
+        key += f"|{gamma}"
+    if size:
+        key += "|{}x{}".format(*size)
+    name = hashlib.sha1(key.encode()).hexdigest()[:16]
+    base = os.path.join(CACHE_DIR, name)
+    return base + ".npy", base + ".json"
+
+
+def load_image(path, flip_x=False, flip_y=True, mipmaps=True, size=None):
+    # [(size, rgb bytes)] from the full image down, flipped for opengl and
+    # resized to size if given, memory mapped from the cache and rebuilt
+    # whenever the source changes
+    gamma = get_gamma(path)
+    data_path, meta_path = get_cache_paths(path, flip_x, flip_y, mipmaps, size, gamma)
+    stat = os.stat(path)
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(data_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+
+    if not is_valid(meta, path, stat, CACHE_VERSION):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        pixels = decode(path, flip_x, flip_y, size)
+        levels = get_mip_chain(pixels, gamma) if mipmaps else [pixels]
+        np.save(data_path, np.concatenate([level.reshape(-1) for level in levels]))
+        offsets = np.cumsum([0] + [level.size for level in levels])
+        meta = {"version": CACHE_VERSION, "source": path, "size": stat.st_size}
+        meta["hash"] = get_file_hash(path)
+        meta["gamma"] = gamma
+        meta["levels"] = [
+            [level.shape[1], level.shape[0], int(offset)]
+            for level, offset in zip(levels, offsets)
+        ]
+    # remember the current mtime so the next start skips hashing
+    if meta.get("mtime") != stat.st_mtime_ns:
+        meta["mtime"] = stat.st_mtime_ns
+        with open(meta_path, "w") as file:
+            json.dump(meta, file)
+
+    data = np.load(data_path, mmap_mode="r")
+    return [
+        ((width, height), data[offset : offset + width * height * 3])
+        for width, height, offset in meta["levels"]
+    ]
@@ -0,0 +1,219 @@
+import numpy as np
+
+# rows allocated up front, the store doubles when full
+TRANSFORM_CAPACITY = 1024
+
+
+def get_rotations(angles):
+    # (n, 3, 3) rotations for xyz euler angles in radians, applied x, then y, then z
+    sx, sy, sz = np.sin(angles).T
+    cx, cy, cz = np.cos(angles).T
+    rotations = np.empty((len(angles), 3, 3), dtype="f4")
+    rotations[:, 0, 0] = cy * cz
+    rotations[:, 0, 1] = sx * sy * cz - cx * sz
+    rotations[:, 0, 2] = cx * sy * cz + sx * sz
+    rotations[:, 1, 0] = cy * sz
+    rotations[:, 1, 1] = sx * sy * sz + cx * cz
+    rotations[:, 1, 2] = cx * sy * sz - sx * cz
+    rotations[:, 2, 0] = -sy
+    rotations[:, 2, 1] = sx * cy
+    rotations[:, 2, 2] = cx * cy
+    return rotations
+
+
+class TransformStore:
+    def __init__(self, capacity=TRANSFORM_CAPACITY):
+        self.count = 0
+        # one row per node, local to its parent, rotations in radians
+        self.positions = np.zeros((capacity, 3), dtype="f4")
+        self.rotations = np.zeros((capacity, 3), dtype="f4")
+        self.scales = np.ones((capacity, 3), dtype="f4")
+        # transposed local and world matrices, glm's byte layout,
+        # see bounds.get_matrices
+        self.locals = np.zeros((capacity, 4, 4), dtype="f4")
+        self.matrices = np.zeros((capacity, 4, 4), dtype="f4")
+        self.locals[:, 3, 3] = 1
+        self.matrices[:, 3, 3] = 1
+        # hierarchy, -1 for roots
+        self.parents = np.full(capacity, -1, dtype="i4")
+        self.depths = np.zeros(capacity, dtype="i4")
+        self.children = {}
+        # rows whose matrices are out of date, a change dirties the whole subtree
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self.any_dirty = False
+        # rows changed since the last get_moved, for whatever caches
+        # static objects where they were, see SceneRenderer.move_static
+        self.moved = np.zeros(capacity, dtype=bool)
+        self.any_moved = False
+
+    def grow(self):
+        names = ("positions", "rotations", "scales", "locals", "matrices")
+        for name in names + ("parents", "depths", "dirty", "moved"):
+            array = getattr(self, name)
+            grown = np.zeros((len(array) * 2, *array.shape[1:]), dtype=array.dtype)
+            grown[: len(array)] = array
+            setattr(self, name, grown)
+        self.scales[self.count :] = 1
+        self.locals[self.count :, 3, 3] = 1
+        self.matrices[self.count :, 3, 3] = 1
+        self.parents[self.count :] = -1
+
+    def add(self, position, rotation, scale):
+        # index of a new root row, the handle models and nodes keep
+        if self.count == len(self.positions):
+            self.grow()
+        index = self.count
+        self.count += 1
+        self.set(index, position, rotation, scale)
+        return index
+
+    def add_many(self, positions, rotations, scales, parent=-1):
+        # rows for many nodes at once, all below parent, returns their indices
+        count = len(positions)
+        while self.count + count > len(self.positions):
+            self.grow()
+        index = np.arange(self.count, self.count + count)
+        self.count += count
+        self.positions[index] = positions
+        self.rotations[index] = rotations
+        self.scales[index] = scales
+        self.parents[index] = parent
+        if parent >= 0:
+            self.children.setdefault(parent, []).extend(index.tolist())
+            self.depths[index] = self.depths[parent] + 1
+        self.mark(index)
+        return index
+
+    def get_subtree(self, index):
+        # index and every row below it
+        rows = [index]
+        for row in rows:
+            rows.extend(self.children.get(row, ()))
+        return rows
+
+    def set_parent(self, index, parent):
+        # the row's transform becomes local to parent, -1 makes it a root again
+        old = self.parents[index]
+        if old >= 0:
+            self.children[old].remove(index)
+        self.parents[index] = parent
+        if parent >= 0:
+            self.children.setdefault(parent, []).append(index)
+        subtree = self.get_subtree(index)
+        depth = self.depths[parent] + 1 if parent >= 0 else 0
+        self.depths[subtree] += depth - self.depths[index]
+        self.mark(subtree)
+
+    def set(self, index, position=None, rotation=None, scale=None):
+        if position is not None:
+            self.positions[index] = position
+        if rotation is not None:
+            self.rotations[index] = rotation
+        if scale is not None:
+            self.scales[index] = scale
+        self.mark(self.get_subtree(index) if index in self.children else index)
+
+    def mark(self, rows):
+        self.dirty[rows] = True
+        self.moved[rows] = True
+        self.any_dirty = True
+        self.any_moved = True
+
+    def get_moved(self):
+        # rows changed since the last call
+        if not self.any_moved:
+            return np.empty(0, dtype="i8")
+        rows = np.flatnonzero(self.moved[: self.count])
+        self.moved[rows] = False
+        self.any_moved = False
+        return rows
+
+    def update_rows(self, index):
+        # local matrices, M = T * Rz * Ry * Rx * S, then world matrices,
+        # the parents of these rows must be up to date
+        rot_scale = get_rotations(self.rotations[index]) * self.scales[index, None, :]
+        self.locals[index, :3, :3] = rot_scale.transpose(0, 2, 1)
+        self.locals[index, 3, :3] = self.positions[index]
+        parents = self.parents[index]
+        roots = parents < 0
+        self.matrices[index[roots]] = self.locals[index[roots]]
+        # transposed, so parent * local becomes local * parent
+        children, parents = index[~roots], parents[~roots]
+        if len(children):
+            self.matrices[children] = self.locals[children] @ self.matrices[parents]
+        self.dirty[index] = False
+
+    def update(self):
+        # rebuild every out of date matrix, one batch per depth, parents first
+        if not self.any_dirty:
+            return
+        index = np.flatnonzero(self.dirty[: self.count])
+        depths = self.depths[index]
+        for depth in range(depths.max() + 1):
+            self.update_rows(index[depths == depth])
+        self.any_dirty = False
+
+    def get_matrix(self, index):
+        # a single row, without scanning the whole store
+        if self.dirty[index]:
+            parent = self.parents[index]
+            if parent >= 0:
+                self.get_matrix(parent)
+            self.update_rows(np.array([index]))
+        return self.matrices[index]
+
+    def get_matrices(self, indices):
+        # world matrices, copies in the order of indices
+        self.update()
+        return self.matrices[indices]
+
+
+class Node:
+    # handle on a store row, its children move with it, see Scene.add_group
+    __slots__ = ("transforms", "index")
+
+    def __init__(self, transforms, pos=(0, 0, 0), rot=(0, 0, 0), scale=(1, 1, 1)):
+        self.transforms = transforms
+        self.index = transforms.add(pos, np.radians(rot), scale)
+
+    def add(self, child):
+        # child keeps its pos, rot and scale, now relative to this node
+        self.transforms.set_parent(child.index, self.index)
+
+    def get_descendants(self):
+        return self.transforms.get_subtree(self.index)[1:]
+
+    # local transform, writes dirty this node and everything below it
+    @property
+    def pos(self):
+        return self.transforms.positions[self.index]
+
+    @pos.setter
+    def pos(self, pos):
+        self.transforms.set(self.index, position=pos)
+
+    @property
+    def rot(self):
+        # radians
+        return self.transforms.rotations[self.index]
+
+    @rot.setter
+    def rot(self, rot):
+        self.transforms.set(self.index, rotation=rot)
+
+    @property
+    def scale(self):
+        return self.transforms.scales[self.index]
+
+    @scale.setter
+    def scale(self, scale):
+        self.transforms.set(self.index, scale=scale)
+
+    @property
+    def m_model(self):
+        # transposed world matrix, glm's byte layout, see bounds.get_matrix
+        return self.transforms.get_matrix(self.index)
+
+    @property
+    def world_position(self):
+        return self.m_model[3, :3]
@@ -1,174 +1,75 @@
-from vbo import VBO
+from vbo import VBO, Registry
 from shader_program import ShaderProgram
 
+# program for a mesh's main vao, "default" if not listed,
+# "shadow_" + name always uses the shadow map program
+PROGRAMS = {
+    "skybox": "skybox",
+    "advanced_skybox": "advanced_skybox",
+}
+
 
 class VAO:
-    def __init__(self, ctx):
+    def __init__(self, ctx, residency):
         self.ctx = ctx
-        self.vbo = VBO(ctx)
+        self.vbo = VBO(ctx, residency)
+        self.vbo.on_evict.append(self.release_vbo)
         self.program = ShaderProgram(ctx)
-        self.vaos = {}
-
-        # cube vao
-        self.vaos["cube"] = self.get_vao(
-            program=self.program.programs["default"], vbo=self.vbo.vbos["cube"]
-        )
-
-        # shadow cube vao
-        self.vaos["shadow_cube"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["cube"]
-        )
-
-        # cat vao
-        self.vaos["cat"] = self.get_vao(
-            program=self.program.programs["default"], vbo=self.vbo.vbos["cat"]
-        )
-
-        # shadow cat vao
-        self.vaos["shadow_cat"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["cat"]
-        )
-
-        # skybox vao
-        self.vaos["skybox"] = self.get_vao(
-            program=self.program.programs["skybox"], vbo=self.vbo.vbos["skybox"]
-        )
-
-        # advanced_skybox vao
-        self.vaos["advanced_skybox"] = self.get_vao(
-            program=self.program.programs["advanced_skybox"],
-            vbo=self.vbo.vbos["advanced_skybox"],
-        )
-
-        # bola vao
-        self.vaos["bola"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["bola"],
-        )
-
-        # apple vao
-        self.vaos["apple"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["apple"],
-        )
-
-        # cone vao
-        self.vaos["cone"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["cone"],
-        )
-
-        # shadow apple vao
-        self.vaos["shadow_apple"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["apple"]
-        )
-
-        # shadow cone vao
-        self.vaos["shadow_cone"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["cone"]
-        )
-
-        # shadow bola vao
-        self.vaos["shadow_bola"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["bola"]
-        )
-
-        # fenceRight vao
-        self.vaos["fenceRight"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["fenceRight"],
-        )
-
-        # shadow fenceRight vao
-        self.vaos["shadow_fenceRight"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["fenceRight"]
-        )
-
-        # fenceback vao
-        self.vaos["fenceback"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["fenceback"],
-        )
+        # one vao per (program, vbo) pair, shared by names with the same source
+        self.pairs = {}
+        # logical name -> vao, built on first use
+        self.vaos = Registry(self.get_named_vao)
+
+    def get_named_vao(self, name):
+        if name.startswith("shadow_"):
+            program, mesh = "shadow_map", name[len("shadow_") :]
+        else:
+            program, mesh = PROGRAMS.get(name, "default"), name
+        return self.get_shared_vao(
+            program=self.program.programs[program], vbo=self.vbo.vbos[mesh]
+        )
+
+    def get_shared_vao(self, program, vbo):
+        key = (program, vbo)
+        if key not in self.pairs:
+            self.pairs[key] = self.get_vao(program=program, vbo=vbo)
+        return self.pairs[key]
+
+    def release_vbo(self, vbo):
+        # vaos of an evicted vbo, and every name pointing at them
+        for key in [key for key in self.pairs if key[1] is vbo]:
+            vao = self.pairs.pop(key)
+            for name in [name for name, value in self.vaos.items() if value is vao]:
+                del self.vaos[name]
+            vao.release()
 
-        # shadow fenceback vao
-        self.vaos["shadow_fenceback"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["fenceback"]
-        )
-
-        # fencefront vao
-        self.vaos["fencefront"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["fencefront"],
-        )
-
-        # shadow fencefront vao
-        self.vaos["shadow_fencefront"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["fencefront"]
-        )
-
-        # papan vao
-        self.vaos["papan"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["papan"],
-        )
-
-        # shadow papan vao
-        self.vaos["shadow_papan"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["papan"]
-        )
-
-        # table vao
-        self.vaos["table"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["table"],
-        )
-
-        # shadow table vao
-        self.vaos["shadow_table"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["table"]
-        )
-
-        # cylinder vao
-        self.vaos["cylinder"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["cylinder"],
-        )
-
-        # shadow cylinder vao
-        self.vaos["shadow_cylinder"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["cylinder"]
-        )
-
-        # darkwall vao
-        self.vaos["darkwall"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["darkwall"],
-        )
-
-        # shadow darkwall vao
-        self.vaos["shadow_darkwall"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["darkwall"]
-        )
-
-        # mug vao
-        self.vaos["mug"] = self.get_vao(
-            program=self.program.programs["default"],
-            vbo=self.vbo.vbos["mug"],
-        )
-
-        # shadow mug vao
-        self.vaos["shadow_mug"] = self.get_vao(
-            program=self.program.programs["shadow_map"], vbo=self.vbo.vbos["mug"]
+    def get_vao(self, program, vbo):
+        vao = self.ctx.vertex_array(
+            program,
+            [(vbo.vbo, vbo.buffer_format, *vbo.attribs)],
+            index_buffer=vbo.ibo,
+            index_element_size=vbo.index_size,
+            skip_errors=True,
         )
+        return vao
 
-
-
-    def get_vao(self, program, vbo):
+    def get_instanced_vao(self, program, vbo, instance_buffer, layers=False):
+        # per-instance model matrix, followed by the texture layer with
+        # texture arrays, advanced once per instance
+        if layers:
+            instance = (instance_buffer, "16f 1f/i", "in_model", "in_layer")
+        else:
+            instance = (instance_buffer, "16f/i", "in_model")
         vao = self.ctx.vertex_array(
-            program, [(vbo.vbo, vbo.format, *vbo.attribs)], skip_errors=True
+            program,
+            [(vbo.vbo, vbo.buffer_format, *vbo.attribs), instance],
+            index_buffer=vbo.ibo,
+            index_element_size=vbo.index_size,
+            skip_errors=True,
         )
         return vao
 
     def destroy(self):
+        [vao.release() for vao in self.pairs.values()]
         self.vbo.destroy()
         self.program.destroy()
@@ -1,54 +1,168 @@
 import numpy as np
 import moderngl as mgl
-import pywavefront
+from bounds import Bounds
+from mesh_cache import load_mesh
+from mesh_processing import optimize_mesh
+from vertex_format import COMPACT_VERTICES, SOURCE_FORMAT, parse_format, pack, unpack
+
+
+class Registry(dict):
+    # dict that builds missing entries on first lookup
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def __missing__(self, key):
+        value = self[key] = self.factory(key)
+        return value
 
 
 class VBO:
-    def __init__(self, ctx):
-        self.vbos = {}
-        self.vbos["cube"] = CubeVBO(ctx)
-        self.vbos["cat"] = CatVBO(ctx)
-        self.vbos["skybox"] = SkyBoxVBO(ctx)
-        self.vbos["advanced_skybox"] = AdvancedSkyBoxVBO(ctx)
-        self.vbos["bola"] = BolaVBO(ctx)
-        self.vbos["apple"] = AppleVBO(ctx)
-        self.vbos["cone"] = ConeVBO(ctx)
-        self.vbos["fenceRight"] = FenceRightVBO(ctx)
-        self.vbos["fenceback"] = FenceBackVBO(ctx)
-        self.vbos["fencefront"] = FenceFrontVBO(ctx)
-        self.vbos["papan"] = ThinRectangleVBO(ctx)
-        self.vbos["table"] = TableVBO(ctx)
-        self.vbos["cylinder"] = CylinderVBO(ctx)
-        self.vbos["darkwall"] = DarkwallVBO(ctx)
-        self.vbos["mug"] = MugVBO(ctx)
+    def __init__(self, ctx, residency):
+        self.ctx = ctx
+        self.residency = residency
+        self.meshes = dict(MESHES)
+        # one vbo per source, shared by every logical name that uses it
+        self.sources = {}
+        self.vbos = Registry(self.load)
+        # called with each evicted vbo, before it is released
+        self.on_evict = []
+
+    def add_mesh(self, name, source):
+        self.meshes[name] = source
+
+    def load(self, name):
+        source = self.meshes[name]
+        if source not in self.sources:
+            if isinstance(source, str):
+                vbo = ObjVBO(self.ctx, source)
+            else:
+                vbo = source(self.ctx)
+            self.sources[source] = vbo
+            self.residency.add(vbo, vbo.get_size(), lambda: self.evict(source))
+        return self.sources[source]
+
+    def evict(self, source):
+        # forget every name using the source, the next lookup reloads it
+        vbo = self.sources.pop(source)
+        for name in [name for name, value in self.vbos.items() if value is vbo]:
+            del self.vbos[name]
+        [callback(vbo) for callback in self.on_evict]
+        vbo.destroy()
 
     def destroy(self):
-        [vbo.destroy() for vbo in self.vbos.values()]
+        [vbo.destroy() for vbo in self.sources.values()]
 
 
 class BaseVBO:
+    format: str = None
+    attribs: list = None
+    # weld the vertices and draw through an index buffer, see mesh_processing.py
+    indexed = True
+
     def __init__(self, ctx):
         self.ctx = ctx
+        self.ibo = None
+        self.index_size = 4
+        # (first, count) draw range of each lod, full detail first
+        self.lods = []
+        # layout in the gpu buffer, differs from format for compact vertices
+        self.buffer_format = self.format
+        self.quantisation_error = (0.0, 0.0)
         self.vbo = self.get_vbo()
-        self.format: str = None
-        self.attribs: list = None
 
     def get_vertex_data(self): ...
 
-    def get_vbo(self):
+    def get_sizes(self):
+        return [count for count, _, _ in parse_format(self.format)]
+
+    def get_positions(self, vertex_data):
+        # split the interleaved data by format and pick out in_position
+        sizes = self.get_sizes()
+        offset = sum(sizes[: self.attribs.index("in_position")])
+        vertex_data = np.asarray(vertex_data, dtype="f4").reshape(-1, sum(sizes))
+        return vertex_data[:, offset : offset + 3]
+
+    def get_mesh_data(self):
+        # (vertices, indices, lod ranges), no indices for a plain vertex list
+        # and no ranges for a single lod
         vertex_data = self.get_vertex_data()
+        if not self.indexed:
+            return vertex_data, None, None
+        return (*optimize_mesh(vertex_data, sum(self.get_sizes())), None)
+
+    def get_vbo(self):
+        vertex_data, index_data, lods = self.get_mesh_data()
+        # local space bounds for culling
+        positions = self.get_positions(vertex_data)
+        self.bounds = Bounds(positions)
+        count = len(positions)
+        if index_data is not None:
+            self.ibo = self.ctx.buffer(index_data)
+            self.index_size = index_data.dtype.itemsize
+            count = len(index_data)
+        if lods is None:
+            lods = [(0, count)]
+        self.lods = [(int(first), int(count)) for first, count in lods]
+        if COMPACT_VERTICES and self.format == SOURCE_FORMAT:
+            vertex_data, self.buffer_format, self.quantisation_error = pack(vertex_data)
         vbo = self.ctx.buffer(vertex_data)
         return vbo
 
+    def get_size(self):
+        # bytes on the gpu
+        return self.vbo.size + (self.ibo.size if self.ibo is not None else 0)
+
+    def read(self, lod=0):
+        # vertices and indices of a lod back from the gpu
+        vertex_data = unpack(self.vbo.read(), self.buffer_format)
+        first, count = self.lods[lod]
+        if self.ibo is None:
+            return vertex_data[first : first + count], np.arange(count, dtype="u4")
+        index_data = np.frombuffer(
+            self.ibo.read(size=count * self.index_size, offset=first * self.index_size),
+            dtype=f"u{self.index_size}",
+        )
+        # each lod uses its own block of vertices
+        start, end = int(index_data.min()), int(index_data.max()) + 1
+        return vertex_data[start:end], index_data - np.array(start, index_data.dtype)
+
     def destroy(self):
         self.vbo.release()
+        if self.ibo is not None:
+            self.ibo.release()
 
 
-class CubeVBO(BaseVBO):
-    def __init__(self, ctx):
+class BakedVBO(BaseVBO):
+    format = "2f 3f 3f"
+    attribs = ["in_texcoord_0", "in_normal", "in_position"]
+
+    def __init__(self, ctx, vertex_data, index_data):
+        self.vertex_data = vertex_data
+        self.index_data = index_data
         super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
+
+    def get_mesh_data(self):
+        # already welded by the source meshes
+        return self.vertex_data, self.index_data, None
+
+
+class ObjVBO(BaseVBO):
+    format = "2f 3f 3f"
+    attribs = ["in_texcoord_0", "in_normal", "in_position"]
+
+    def __init__(self, ctx, path):
+        self.path = path
+        super().__init__(ctx)
+
+    def get_mesh_data(self):
+        # welded and memory mapped from the mesh cache, see mesh_cache.py
+        return load_mesh(self.path)
+
+
+class CubeVBO(BaseVBO):
+    format = "2f 3f 3f"
+    attribs = ["in_texcoord_0", "in_normal", "in_position"]
 
     @staticmethod
     def get_data(vertices, indices):
@@ -115,42 +229,9 @@ class CubeVBO(BaseVBO):
         return vertex_data
 
 
-class CatVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "objects/cat/fence.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-    # def get_vertex_data(self):
-    #     # objs = pywavefront.Wavefront('objects/cat/20430_Cat_v1_NEW.obj', cache=True, parse=True)
-    #     objs = pywavefront.Wavefront("objects/cat/fence.obj", cache=True, parse=True)
-    #     obj = objs.materials.popitem()[1]
-    #     vertex_data = obj.vertices
-    #     vertex_data = np.array(vertex_data, dtype="f4")
-    #     return vertex_data
-
-
 class SkyBoxVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "3f"
-        self.attribs = ["in_position"]
+    format = "3f"
+    attribs = ["in_position"]
 
     @staticmethod
     def get_data(vertices, indices):
@@ -189,10 +270,9 @@ class SkyBoxVBO(BaseVBO):
 
 
 class AdvancedSkyBoxVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "3f"
-        self.attribs = ["in_position"]
+    format = "3f"
+    attribs = ["in_position"]
+    indexed = False
 
     def get_vertex_data(self):
         # in clip space
@@ -202,149 +282,9 @@ class AdvancedSkyBoxVBO(BaseVBO):
         return vertex_data
 
 
-class BolaVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "objects/sphere/sphere.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
-class AppleVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "newobjects/Models/apple.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
-class ConeVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "newobjects/Models/cone.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
-class FenceRightVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "objects/cat/fence.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
-class FenceBackVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "objects/cat/fence.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
-class FenceFrontVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "objects/cat/fence.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
 class ThinRectangleVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
+    format = "2f 3f 3f"
+    attribs = ["in_texcoord_0", "in_normal", "in_position"]
 
     @staticmethod
     def get_data(vertices, indices):
@@ -413,10 +353,8 @@ class ThinRectangleVBO(BaseVBO):
 
 
 class TableVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
+    format = "2f 3f 3f"
+    attribs = ["in_texcoord_0", "in_normal", "in_position"]
 
     @staticmethod
     def get_data(vertices, indices):
@@ -534,70 +472,21 @@ class TableVBO(BaseVBO):
         return vertex_data
 
 
-class CylinderVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "newobjects/Models/cylinder.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
-class DarkwallVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "newobjects/Models/darkWallTest.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
-
-
-class MugVBO(BaseVBO):
-    def __init__(self, ctx):
-        super().__init__(ctx)
-        self.format = "2f 3f 3f"
-        self.attribs = ["in_texcoord_0", "in_normal", "in_position"]
-
-    def get_vertex_data(self):
-        # Load .obj without .mtl
-        objs = pywavefront.Wavefront(
-            "objects/mug/mug.obj",
-            cache=True,
-            parse=True,
-            collect_faces=True,  # Ensure face data is collected
-            create_materials=True,  # Automatically create default materials
-        )
-
-        # Extract geometry data from the first material
-        obj = list(objs.materials.values())[0]
-        vertex_data = obj.vertices  # Access vertex data
-        vertex_data = np.array(vertex_data, dtype="f4")  # Convert to NumPy array
-        return vertex_data
+# logical mesh name -> .obj path or procedural vbo class
+MESHES = {
+    "cube": CubeVBO,
+    "cat": "objects/cat/fence.obj",
+    "skybox": SkyBoxVBO,
+    "advanced_skybox": AdvancedSkyBoxVBO,
+    "bola": "objects/sphere/sphere.obj",
+    "apple": "newobjects/Models/apple.obj",
+    "cone": "newobjects/Models/cone.obj",
+    "fenceRight": "objects/cat/fence.obj",
+    "fenceback": "objects/cat/fence.obj",
+    "fencefront": "objects/cat/fence.obj",
+    "papan": ThinRectangleVBO,
+    "table": TableVBO,
+    "cylinder": "newobjects/Models/cylinder.obj",
+    "darkwall": "newobjects/Models/darkWallTest.obj",
+    "mug": "objects/mug/mug.obj",
+}
@@ -0,0 +1,89 @@
+import re
+import numpy as np
+
+# pack meshes as half float uvs, unsigned normalized byte normals (decoded in
+# the vertex shaders) and full float positions, 20 instead of 32 bytes a vertex
+COMPACT_VERTICES = False
+SOURCE_FORMAT = "2f 3f 3f"
+COMPACT_FORMAT = "2f2 4f1 3f"
+# uvs that do not fit half floats, e.g. large tiling factors
+WIDE_UV_FORMAT = "2f 4f1 3f"
+# largest quantisation error a mesh may have, uv units and degrees
+MAX_UV_ERROR = 1 / 2048
+MAX_NORMAL_ERROR = 1.0
+
+DTYPES = {("f", 1): "u1", ("f", 2): "f2", ("f", 4): "f4", ("i", 4): "i4", ("u", 4): "u4"}
+
+
+def parse_format(fmt):
+    # [(count, kind, bytes)] per attribute of a moderngl format string
+    attributes = []
+    for token in fmt.split():
+        match = re.fullmatch(r"(\d*)([fiu])(\d?)(/\w)?", token)
+        count, kind, size = match.group(1), match.group(2), match.group(3)
+        attributes.append((int(count or 1), kind, int(size or 4)))
+    return attributes
+
+
+def get_dtype(fmt):
+    return np.dtype(
+        [
+            (f"a{i}", DTYPES[kind, size], count)
+            for i, (count, kind, size) in enumerate(parse_format(fmt))
+        ]
+    )
+
+
+def encode_normals(normals):
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = normals / np.maximum(lengths, 1e-8)
+    encoded = np.zeros((len(normals), 4), dtype="u1")
+    encoded[:, :3] = np.round((normals * 0.5 + 0.5) * 255)
+    return encoded
+
+
+def decode_normals(encoded):
+    return encoded[:, :3].astype("f4") / 255 * 2 - 1
+
+
+def get_normal_error(normals, encoded):
+    # largest angle between the source and decoded normals, zero normals skipped
+    lengths = np.linalg.norm(normals, axis=1)
+    keep = lengths > 1e-8
+    if not keep.any():
+        return 0.0
+    decoded = decode_normals(encoded[keep])
+    decoded /= np.linalg.norm(decoded, axis=1, keepdims=True)
+    cos = np.einsum("ij,ij->i", normals[keep] / lengths[keep, None], decoded)
+    return float(np.degrees(np.arccos(np.clip(cos, -1, 1))).max())
+
+
+def pack(vertex_data):
+    # source layout -> (packed data, format, (uv error, normal error))
+    vertex_data = np.asarray(vertex_data, dtype="f4").reshape(-1, 8)
+    uvs = vertex_data[:, :2]
+    uv_error = float(np.abs(uvs.astype("f2").astype("f4") - uvs).max(initial=0))
+    normals = encode_normals(vertex_data[:, 2:5])
+    normal_error = get_normal_error(vertex_data[:, 2:5], normals)
+    if normal_error > MAX_NORMAL_ERROR:
+        raise ValueError(f"normal quantisation error of {normal_error:.2f} degrees")
+    # the per-mesh check only has to pick the uv encoding,
+    # byte normals stay within MAX_NORMAL_ERROR for any unit vector
+    fmt = COMPACT_FORMAT if uv_error <= MAX_UV_ERROR else WIDE_UV_FORMAT
+    if fmt == WIDE_UV_FORMAT:
+        uv_error = 0.0
+    packed = np.empty(len(vertex_data), dtype=get_dtype(fmt))
+    packed["a0"], packed["a1"], packed["a2"] = uvs, normals, vertex_data[:, 5:8]
+    return packed, fmt, (uv_error, normal_error)
+
+
+def unpack(data, fmt):
+    # raw buffer bytes -> float rows, byte normals decoded
+    packed = np.frombuffer(data, dtype=get_dtype(fmt))
+    columns = []
+    for i, (count, kind, size) in enumerate(parse_format(fmt)):
+        column = packed[f"a{i}"].reshape(len(packed), count)
+        if (kind, size) == ("f", 1):
+            column = decode_normals(column)
+        columns.append(column.astype("f4"))
+    return np.hstack(columns)